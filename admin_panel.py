@@ -1,35 +1,149 @@
-from typing import Dict
+import html
+import threading
+import time
+from datetime import datetime, timedelta
 import telebot
 from telebot import types
-from config import DB_PATH
+from config import DB_PATH, ADMIN_STEP_TTL, ADMIN_CACHE_TTL, DEFAULT_MODELS
+from dispatch import LANE_ADMIN, format_lane_stats
+from gateway import PACER, format_gateway_stats
+from tracing import SLOW_TRACES, format_slow_traces
+from router import Router, CB_ADMIN, cb_data
+from user_panel import phrase_key, SPEED_MODES
+
+ADMIN_STEPS = "admin_steps"
+PHRASES_PER_PAGE = 10
 
 
 def build_admin_menu():
     kb = types.InlineKeyboardMarkup()
-    kb.add(types.InlineKeyboardButton("Manage Credits", callback_data="admin:credits"))
-    kb.add(types.InlineKeyboardButton("Manage Validity", callback_data="admin:validity"))
-    kb.add(types.InlineKeyboardButton("List Users", callback_data="admin:list_users"))
-    kb.add(types.InlineKeyboardButton("List Premium Users", callback_data="admin:list_premium"))
-    kb.add(types.InlineKeyboardButton("Broadcast", callback_data="admin:broadcast"))
-    kb.add(types.InlineKeyboardButton("Download Data", callback_data="admin:download"))
-    kb.add(types.InlineKeyboardButton("Manage Admins", callback_data="admin:admins"))
+    kb.add(types.InlineKeyboardButton("Manage Credits", callback_data=cb_data(CB_ADMIN, "credits")))
+    kb.add(types.InlineKeyboardButton("Manage Validity", callback_data=cb_data(CB_ADMIN, "validity")))
+    kb.add(types.InlineKeyboardButton("Stats", callback_data=cb_data(CB_ADMIN, "stats")))
+    kb.add(types.InlineKeyboardButton("List Users", callback_data=cb_data(CB_ADMIN, "list_users")))
+    kb.add(types.InlineKeyboardButton("List Premium Users", callback_data=cb_data(CB_ADMIN, "list_premium")))
+    kb.add(types.InlineKeyboardButton("Broadcast", callback_data=cb_data(CB_ADMIN, "broadcast")))
+    kb.add(types.InlineKeyboardButton("Download Data", callback_data=cb_data(CB_ADMIN, "download")))
+    kb.add(types.InlineKeyboardButton("Manage Admins", callback_data=cb_data(CB_ADMIN, "admins")))
+    kb.add(types.InlineKeyboardButton("Dispatch Lanes", callback_data=cb_data(CB_ADMIN, "lanes")))
+    kb.add(types.InlineKeyboardButton("Phrase Library", callback_data=cb_data(CB_ADMIN, "phrases")))
     return kb
 
 
-def build_user_list_keyboard(users, prefix: str):
+def build_phrases_keyboard(phrases, page: int, pages: int):
+    kb = types.InlineKeyboardMarkup()
+    for p in phrases:
+        kb.add(types.InlineKeyboardButton(f"🗑 #{p['id']} {p['text'][:40]}", callback_data=cb_data(CB_ADMIN, "phrases", "del", p["id"])))
+    nav = []
+    if page > 0:
+        nav.append(types.InlineKeyboardButton("◀ Prev", callback_data=cb_data(CB_ADMIN, "phrases", "page", page - 1)))
+    if page + 1 < pages:
+        nav.append(types.InlineKeyboardButton("Next ▶", callback_data=cb_data(CB_ADMIN, "phrases", "page", page + 1)))
+    if nav:
+        kb.row(*nav)
+    kb.add(types.InlineKeyboardButton("➕ Add Phrase", callback_data=cb_data(CB_ADMIN, "phrases", "add")))
+    kb.add(types.InlineKeyboardButton("⬅ Back", callback_data=cb_data(CB_ADMIN, "menu")))
+    return kb
+
+
+def format_phrases(phrases, page: int, pages: int) -> str:
+    if not phrases:
+        return "📚 Phrase library is empty."
+    per_phrase = len(DEFAULT_MODELS) * len(SPEED_MODES)
+    lines = [f"📚 Phrase library (page {page + 1}/{pages})"]
+    for p in phrases:
+        # Phrase texts come from users; the bot sends with parse_mode=HTML
+        lines.append(f"#{p['id']} [{p['source']}] {p['ready']}/{per_phrase} ready: {html.escape(p['text'][:80])}")
+    return "\n".join(lines)
+
+
+def build_user_list_keyboard(users, section: str):
     kb = types.InlineKeyboardMarkup()
     for u in users:
         label = f"{u['id']} @{u.get('username') or 'unknown'}"
-        kb.add(types.InlineKeyboardButton(label, callback_data=f"{prefix}:{u['id']}"))
-    kb.add(types.InlineKeyboardButton("⬅ Back", callback_data="admin:menu"))
+        kb.add(types.InlineKeyboardButton(label, callback_data=cb_data(CB_ADMIN, section, "user", u["id"])))
+    kb.add(types.InlineKeyboardButton("⬅ Back", callback_data=cb_data(CB_ADMIN, "menu")))
     return kb
 
 
-def register_admin_handlers(bot: telebot.TeleBot, db):
-    admin_steps: Dict[int, Dict] = {}
+def _stats_block(title: str, stats) -> list:
+    names = {m["id"]: m["name"] for m in DEFAULT_MODELS}
+
+    def total(metric):
+        return sum(stats.get(metric, {}).values())
+
+    lines = [f"<b>{title}</b>"]
+    if "active_users" in stats:
+        lines.append(f"Active users: {total('active_users')}")
+    lines.append(f"New users: {total('new_users')}")
+    lines.append(f"Voices: {total('voices')} | Characters: {total('chars')}")
+    for model_id, count in sorted(stats.get("voices", {}).items(), key=lambda kv: -kv[1]):
+        lines.append(f"  • {names.get(model_id, model_id or 'unknown')}: {count}")
+    lines.append(f"Credits consumed: {total('credits_consumed')} | added: {total('credits_added')}")
+    lines.append(f"Phrase library hits: {total('phrase_hits')}")
+    lines.append(f"Upstream errors: {total('upstream_errors')}")
+    return lines
+
+
+def format_stats(db) -> str:
+    """Statistics view, read from the rollup tables only."""
+    now = datetime.utcnow()
+    this_hour = db.read_stats("stats_hourly", now.strftime("%Y-%m-%dT%H"))
+    today = db.read_stats("stats_daily", now.strftime("%Y-%m-%d"))
+    week = db.read_stats("stats_daily", (now - timedelta(days=6)).strftime("%Y-%m-%d"))
+    # Daily active counts cannot be summed across days into distinct users
+    week.pop("active_users", None)
+
+    lines = ["📈 Stats (UTC)"]
+    lines += _stats_block("This hour", this_hour) + [""]
+    lines += _stats_block("Today", today) + [""]
+    lines += _stats_block("Last 7 days", week)
+    return "\n".join(lines)
+
+
+class AdminCache:
+    """
+    Admin ids held in memory so admin checks cost no query per update.
+    Reloaded from the database every ``ttl`` seconds, so changes made by
+    another process show up within that window.
+    """
+
+    def __init__(self, db, ttl: int = ADMIN_CACHE_TTL):
+        self.db = db
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._ids = frozenset()
+        self._loaded_at = float("-inf")
+
+    def refresh(self):
+        ids = frozenset(self.db.get_admins())
+        with self._lock:
+            self._ids = ids
+            self._loaded_at = time.monotonic()
+
+    def __contains__(self, user_id: int) -> bool:
+        if time.monotonic() - self._loaded_at > self.ttl:
+            self.refresh()
+        return user_id in self._ids
+
+
+def register_admin_handlers(bot: telebot.TeleBot, db, state, router: Router):
+    admins = AdminCache(db)
+
+    def set_step(uid: int, step):
+        state.set(ADMIN_STEPS, uid, step, ttl_seconds=ADMIN_STEP_TTL)
+
+    def has_step(uid: int) -> bool:
+        # Runs for every message: only admins have steps, and the cached check
+        # keeps everyone else's messages away from the state store
+        return uid in admins and state.get(ADMIN_STEPS, uid) is not None
 
     def ensure_admin(uid: int):
-        return db.is_admin(uid)
+        return uid in admins
+
+    if hasattr(bot, "add_lane_rule"):
+        bot.add_lane_rule(lambda u: u.message is not None and has_step(u.message.from_user.id), LANE_ADMIN)
+        bot.add_lane_rule(lambda u: u.message is not None and (u.message.text or "").startswith("/slow"), LANE_ADMIN)
 
     @bot.message_handler(commands=["admin"])
     def admin_cmd(message):
@@ -37,123 +151,169 @@ def register_admin_handlers(bot: telebot.TeleBot, db):
             return
         bot.send_message(message.chat.id, "⚙️ Admin Panel", reply_markup=build_admin_menu())
 
-    @bot.callback_query_handler(func=lambda c: c.data.startswith("admin:"))
-    def cb(callback):
-        uid = callback.from_user.id
-        if not ensure_admin(uid):
-            return bot.answer_callback_query(callback.id)
+    @bot.message_handler(commands=["slow"])
+    def slow_cmd(message):
+        if not ensure_admin(message.from_user.id):
+            return
+        args = (message.text or "").split()
+        n = int(args[1]) if len(args) > 1 and args[1].isdigit() else 10
+        bot.send_message(message.chat.id, format_slow_traces(SLOW_TRACES.worst(n)))
 
-        bot.answer_callback_query(callback.id)
-        parts = callback.data.split(":")
-        section = parts[1]
-
-        # -----------------------
-        # MAIN MENU
-        # -----------------------
-        if section == "menu":
-            return bot.edit_message_reply_markup(
-                callback.message.chat.id,
-                callback.message.message_id,
-                build_admin_menu()
-            )
+    # -----------------------
+    # MAIN MENU
+    # -----------------------
+    def show_menu(callback, args):
+        return bot.edit_message_reply_markup(
+            callback.message.chat.id,
+            callback.message.message_id,
+            build_admin_menu()
+        )
 
-        # -----------------------
-        # CREDITS → SHOW USERS
-        # -----------------------
-        if section == "credits" and len(parts) == 2:
+    # -----------------------
+    # CREDITS: users → user → amount input
+    # -----------------------
+    def credits(callback, args):
+        chat_id = callback.message.chat.id
+        if not args:
             users = db.list_users(limit=200)
-            kb = build_user_list_keyboard(users, "admin:credits:user")
-            return bot.send_message(callback.message.chat.id, "Select a user:", reply_markup=kb)
+            return bot.send_message(chat_id, "Select a user:", reply_markup=build_user_list_keyboard(users, "credits"))
 
-        # -----------------------
-        # VALIDITY → SHOW USERS
-        # -----------------------
-        if section == "validity" and len(parts) == 2:
-            users = db.list_users(limit=200)
-            kb = build_user_list_keyboard(users, "admin:validity:user")
-            return bot.send_message(callback.message.chat.id, "Select a user:", reply_markup=kb)
-
-        # -----------------------
-        # SELECTED USER FOR CREDITS
-        # -----------------------
-        if section == "credits" and parts[2] == "user":
-            user_id = int(parts[3])
+        user_id = int(args[1])
+        if args[0] == "user":
             kb = types.InlineKeyboardMarkup()
-            kb.add(types.InlineKeyboardButton("Add Credits", callback_data=f"admin:credits:add:{user_id}"))
-            kb.add(types.InlineKeyboardButton("Remove Credits", callback_data=f"admin:credits:remove:{user_id}"))
-            kb.add(types.InlineKeyboardButton("⬅ Back", callback_data="admin:credits"))
-            return bot.send_message(callback.message.chat.id, f"User {user_id}\nChoose action:", reply_markup=kb)
-
-        # -----------------------
-        # SELECTED USER FOR VALIDITY
-        # -----------------------
-        if section == "validity" and parts[2] == "user":
-            user_id = int(parts[3])
+            kb.add(types.InlineKeyboardButton("Add Credits", callback_data=cb_data(CB_ADMIN, "credits", "add", user_id)))
+            kb.add(types.InlineKeyboardButton("Remove Credits", callback_data=cb_data(CB_ADMIN, "credits", "remove", user_id)))
+            kb.add(types.InlineKeyboardButton("⬅ Back", callback_data=cb_data(CB_ADMIN, "credits")))
+            return bot.send_message(chat_id, f"User {user_id}\nChoose action:", reply_markup=kb)
+
+        if args[0] in ("add", "remove"):
+            set_step(callback.from_user.id, {"action": args[0], "target": user_id})
+            return bot.send_message(chat_id, "Send credit amount:")
+
+    # -----------------------
+    # VALIDITY: users → user → set/remove
+    # -----------------------
+    def validity(callback, args):
+        chat_id = callback.message.chat.id
+        if not args:
+            users = db.list_users(limit=200)
+            return bot.send_message(chat_id, "Select a user:", reply_markup=build_user_list_keyboard(users, "validity"))
+
+        user_id = int(args[1])
+        if args[0] == "user":
             kb = types.InlineKeyboardMarkup()
-            kb.add(types.InlineKeyboardButton("Set Validity", callback_data=f"admin:validity:set:{user_id}"))
-            kb.add(types.InlineKeyboardButton("Remove Validity", callback_data=f"admin:validity:remove:{user_id}"))
-            kb.add(types.InlineKeyboardButton("⬅ Back", callback_data="admin:validity"))
-            return bot.send_message(callback.message.chat.id, f"User {user_id}\nChoose action:", reply_markup=kb)
-
-        # -----------------------
-        # CREDIT AMOUNT INPUT
-        # -----------------------
-        if section == "credits" and parts[2] in ("add", "remove"):
-            admin_steps[uid] = {"action": parts[2], "target": int(parts[3])}
-            return bot.send_message(callback.message.chat.id, "Send credit amount:")
-
-        # -----------------------
-        # VALIDITY INPUT
-        # -----------------------
-        if section == "validity" and parts[2] == "set":
-            admin_steps[uid] = {"action": "set_validity", "target": int(parts[3])}
-            return bot.send_message(callback.message.chat.id, "Send number of days:")
-
-        if section == "validity" and parts[2] == "remove":
-            target = int(parts[3])
-            db.remove_validity(target)
-            return bot.send_message(callback.message.chat.id, f"✔ Removed validity for {target}")
-
-        # -----------------------
-        # LIST USERS
-        # -----------------------
-        if section == "list_users":
-            users = db.list_users()
-            text = "\n".join([f"{u['id']} @{u.get('username')} | credits={u.get('credits')}" for u in users])
-            return bot.send_message(callback.message.chat.id, text or "No users")
-
-        # -----------------------
-        # LIST PREMIUM
-        # -----------------------
-        if section == "list_premium":
-            users = db.list_premium_users()
-            text = "\n".join([f"{u['id']} credits={u.get('credits')} exp={u.get('validity_expire_at')}" for u in users])
-            return bot.send_message(callback.message.chat.id, text or "No premium users")
-
-        # -----------------------
-        # BROADCAST
-        # -----------------------
-        if section == "broadcast":
-            admin_steps[uid] = {"action": "broadcast", "target": 0}
-            return bot.send_message(callback.message.chat.id, "Send broadcast message:")
-
-        # -----------------------
-        # DOWNLOAD DB
-        # -----------------------
-        if section == "download":
-            try:
-                with open(DB_PATH, "rb") as f:
-                    return bot.send_document(callback.message.chat.id, f)
-            except Exception:
-                return bot.send_message(callback.message.chat.id, "DB not found!")
+            kb.add(types.InlineKeyboardButton("Set Validity", callback_data=cb_data(CB_ADMIN, "validity", "set", user_id)))
+            kb.add(types.InlineKeyboardButton("Remove Validity", callback_data=cb_data(CB_ADMIN, "validity", "remove", user_id)))
+            kb.add(types.InlineKeyboardButton("⬅ Back", callback_data=cb_data(CB_ADMIN, "validity")))
+            return bot.send_message(chat_id, f"User {user_id}\nChoose action:", reply_markup=kb)
+
+        if args[0] == "set":
+            set_step(callback.from_user.id, {"action": "set_validity", "target": user_id})
+            return bot.send_message(chat_id, "Send number of days:")
+
+        if args[0] == "remove":
+            db.remove_validity(user_id)
+            return bot.send_message(chat_id, f"✔ Removed validity for {user_id}")
+
+    # -----------------------
+    # STATS
+    # -----------------------
+    def stats(callback, args):
+        return bot.send_message(callback.message.chat.id, format_stats(db))
+
+    # -----------------------
+    # LIST USERS
+    # -----------------------
+    def list_users(callback, args):
+        users = db.list_users()
+        text = "\n".join([f"{u['id']} @{u.get('username')} | credits={u.get('credits')}" for u in users])
+        return bot.send_message(callback.message.chat.id, text or "No users")
+
+    # -----------------------
+    # LIST PREMIUM
+    # -----------------------
+    def list_premium(callback, args):
+        users = db.list_premium_users()
+        text = "\n".join([f"{u['id']} credits={u.get('credits')} exp={u.get('validity_expire_at')}" for u in users])
+        return bot.send_message(callback.message.chat.id, text or "No premium users")
+
+    # -----------------------
+    # BROADCAST
+    # -----------------------
+    def broadcast(callback, args):
+        set_step(callback.from_user.id, {"action": "broadcast", "target": 0})
+        return bot.send_message(callback.message.chat.id, "Send broadcast message:")
+
+    # -----------------------
+    # DISPATCH LANES
+    # -----------------------
+    def lanes(callback, args):
+        if not hasattr(bot, "lane_stats"):
+            return bot.send_message(callback.message.chat.id, "Lanes are not enabled.")
+        text = format_lane_stats(bot.lane_stats()) + "\n" + format_gateway_stats(PACER.stats())
+        return bot.send_message(callback.message.chat.id, text)
+
+    # -----------------------
+    # PHRASE LIBRARY
+    # -----------------------
+    def phrases(callback, args):
+        chat_id = callback.message.chat.id
+        if not args or args[0] == "page":
+            pages = max(1, -(-db.count_phrases() // PHRASES_PER_PAGE))
+            page = min(int(args[1]), pages - 1) if args else 0
+            items = db.list_phrases(PHRASES_PER_PAGE, page * PHRASES_PER_PAGE)
+            return bot.send_message(
+                chat_id, format_phrases(items, page, pages), reply_markup=build_phrases_keyboard(items, page, pages)
+            )
+
+        if args[0] == "add":
+            set_step(callback.from_user.id, {"action": "add_phrase", "target": 0})
+            return bot.send_message(chat_id, "Send the phrase text:")
+
+        if args[0] == "del":
+            db.delete_phrase(int(args[1]))
+            return bot.send_message(chat_id, f"✔ Removed phrase #{args[1]}")
+
+    # -----------------------
+    # DOWNLOAD DB
+    # -----------------------
+    def download(callback, args):
+        try:
+            with open(DB_PATH, "rb") as f:
+                return bot.send_document(callback.message.chat.id, f)
+        except Exception:
+            return bot.send_message(callback.message.chat.id, "DB not found!")
+
+    sections = {
+        "menu": show_menu,
+        "credits": credits,
+        "validity": validity,
+        "stats": stats,
+        "list_users": list_users,
+        "list_premium": list_premium,
+        "broadcast": broadcast,
+        "lanes": lanes,
+        "phrases": phrases,
+        "download": download,
+    }
+
+    @router.on_callback(CB_ADMIN)
+    def cb(callback, args):
+        if not ensure_admin(callback.from_user.id):
+            return bot.answer_callback_query(callback.id)
+
+        bot.answer_callback_query(callback.id)
+        handler = sections.get(args[0]) if args else None
+        if handler:
+            return handler(callback, args[1:])
 
     # -----------------------
     # STEP HANDLER
     # -----------------------
-    @bot.message_handler(func=lambda m: m.from_user.id in admin_steps)
+    @router.intercept(lambda m: has_step(m.from_user.id))
     def step_handler(msg):
         uid = msg.from_user.id
-        step = admin_steps.pop(uid, None)
+        step = state.pop(ADMIN_STEPS, uid)
         if not step:
             return
 
@@ -176,10 +336,17 @@ def register_admin_handlers(bot: telebot.TeleBot, db):
                 db.set_validity(target, days)
                 return bot.send_message(msg.chat.id, f"✔ Validity set for {target}")
 
+            if action == "add_phrase":
+                text = (msg.text or "").strip()
+                if not text:
+                    return bot.send_message(msg.chat.id, "❌ Empty phrase")
+                if db.add_phrase(phrase_key(text), text, "admin") is None:
+                    return bot.send_message(msg.chat.id, "Phrase is already in the library.")
+                return bot.send_message(msg.chat.id, "✔ Phrase added; it will be voiced in the next quiet hours.")
+
             # ✅ FIXED BROADCAST (rate limit + report)
+            # Pacing and 429 handling are done by the outbound gateway
             if action == "broadcast":
-                import time
-
                 users = db.list_users(limit=100000)
                 sent = 0
                 failed = 0
@@ -191,10 +358,8 @@ def register_admin_handlers(bot: telebot.TeleBot, db):
                     try:
                         bot.send_message(uid2, msg.text)
                         sent += 1
-                        time.sleep(0.05)  # ~20 msg/sec safe
                     except Exception:
                         failed += 1
-                        time.sleep(0.2)   # small backoff
 
                 return bot.send_message(
                     msg.chat.id,
@@ -0,0 +1,231 @@
+import asyncio
+import logging
+from typing import Callable, List, Optional
+from aiohttp import web
+from telebot import asyncio_helper, types
+from telebot.async_telebot import AsyncTeleBot
+from config import (
+    TELEGRAM_BOT_TOKEN, ADMIN_IDS, USE_WEBHOOK, WEBHOOK_BASE_URL, PORT,
+    POLL_BATCH_SIZE, POLL_TIMEOUT, POLL_BACKLOG_CONCURRENCY,
+)
+from dispatch import LANE_ADMIN
+from batch import is_batch_upload
+from inline import is_inline_update
+from gateway import GATEWAY
+from polling import ALLOWED_UPDATES, prepare_backlog
+from router import Router
+from user_panel import register_user_handlers_async
+
+
+class BridgedAsyncTeleBot(AsyncTeleBot):
+    """
+    AsyncTeleBot serving the user flows on the event loop. Admin updates,
+    batch uploads and inline mode are handed to the threaded bot, which keeps
+    the admin panel and long-running or debounced work off the loop.
+    """
+
+    def __init__(self, token: str, sync_bot, **kwargs):
+        super().__init__(token, **kwargs)
+        self.sync_bot = sync_bot
+        # Called (in the executor) with update ids once their handlers have run
+        self.on_updates_done: Optional[Callable[[List[int]], None]] = None
+
+    async def _to_sync(self, update: types.Update) -> bool:
+        if is_batch_upload(update) or is_inline_update(update):
+            return True
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.sync_bot.classify, update) == LANE_ADMIN
+
+    async def process_new_updates(self, updates: List[types.Update]):
+        loop = asyncio.get_running_loop()
+        sync_updates = []
+        user_updates = []
+        for update in updates:
+            (sync_updates if await self._to_sync(update) else user_updates).append(update)
+        if sync_updates:
+            self.sync_bot.process_new_updates(sync_updates)
+        if user_updates:
+            try:
+                await super().process_new_updates(user_updates)
+            finally:
+                if self.on_updates_done is not None:
+                    await loop.run_in_executor(None, self.on_updates_done, [u.update_id for u in user_updates])
+
+    async def process_inline(self, update: types.Update):
+        """Run ``update``'s handlers to completion; threaded-bot updates run in the executor."""
+        loop = asyncio.get_running_loop()
+        if await self._to_sync(update):
+            return await loop.run_in_executor(None, self.sync_bot.process_inline, update)
+        try:
+            await super().process_new_updates([update])
+        finally:
+            if self.on_updates_done is not None:
+                await loop.run_in_executor(None, self.on_updates_done, [update.update_id])
+
+    # Outbound calls share the threaded bot's pacer through the gateway
+    async def send_message(self, chat_id, text, *args, **kwargs):
+        return await GATEWAY.acall(super().send_message, chat_id, chat_id, text, *args, **kwargs)
+
+    async def send_voice(self, chat_id, voice, *args, **kwargs):
+        return await GATEWAY.acall(super().send_voice, chat_id, chat_id, voice, *args, **kwargs)
+
+    async def send_document(self, chat_id, document, *args, **kwargs):
+        return await GATEWAY.acall(super().send_document, chat_id, chat_id, document, *args, **kwargs)
+
+    async def edit_message_text(self, text, chat_id=None, message_id=None, **kwargs):
+        return await GATEWAY.acall(super().edit_message_text, chat_id, text, chat_id=chat_id, message_id=message_id, **kwargs)
+
+    async def delete_message(self, chat_id, message_id, *args, **kwargs):
+        return await GATEWAY.acall(super().delete_message, chat_id, chat_id, message_id, *args, **kwargs)
+
+    async def answer_callback_query(self, callback_query_id, *args, **kwargs):
+        return await GATEWAY.acall(super().answer_callback_query, None, callback_query_id, *args, **kwargs)
+
+
+async def _notify_online(bot: AsyncTeleBot, text: str):
+    for aid in ADMIN_IDS[:1]:
+        try:
+            await bot.send_message(aid, text)
+        except Exception:
+            pass
+
+
+async def _drain_backlog(bot: BridgedAsyncTeleBot, db):
+    """Async counterpart of polling.drain_backlog."""
+    loop = asyncio.get_running_loop()
+    try:
+        while True:
+            offset = await loop.run_in_executor(None, db.get_update_offset)
+            raw = await asyncio_helper.get_updates(
+                bot.token, offset + 1, POLL_BATCH_SIZE, allowed_updates=ALLOWED_UPDATES, request_timeout=POLL_TIMEOUT
+            )
+            if not raw:
+                break
+            await loop.run_in_executor(None, db.journal_updates, raw)
+    except Exception as e:
+        logging.warning(f"Could not fetch queued updates: {e}")
+
+    pending = await loop.run_in_executor(None, db.list_pending_updates)
+    groups = await loop.run_in_executor(None, prepare_backlog, bot.sync_bot, db, pending)
+    if not groups:
+        return
+    logging.info(f"Draining backlog: {sum(len(g) for g in groups)} updates from {len(groups)} chats")
+    slots = asyncio.Semaphore(POLL_BACKLOG_CONCURRENCY)
+
+    async def run_group(group):
+        async with slots:
+            for update in group:
+                try:
+                    await bot.process_inline(update)
+                except Exception as e:
+                    logging.exception(f"Backlog update {update.update_id} failed: {e}")
+
+    await asyncio.gather(*(run_group(g) for g in groups))
+
+
+async def _run_polling(bot: BridgedAsyncTeleBot, db):
+    try:
+        await bot.delete_webhook()
+    except Exception:
+        pass
+    try:
+        me = await bot.get_me()
+        print(f"Bot started (async), polling as @{me.username}")
+        await _notify_online(bot, f"Bot @{me.username} is online and polling (async).")
+    except Exception:
+        print("Bot started (async), polling...")
+
+    # Same journal as the threaded poller: resume from the stored offset, never skip pending updates
+    bot.on_updates_done = db.finish_updates
+    bot.sync_bot.on_updates_done = db.finish_updates
+    await _drain_backlog(bot, db)
+
+    loop = asyncio.get_running_loop()
+    tasks = set()
+    errors = 0
+    while True:
+        try:
+            offset = await loop.run_in_executor(None, db.get_update_offset)
+            raw = await asyncio_helper.get_updates(
+                bot.token, offset + 1, POLL_BATCH_SIZE, POLL_TIMEOUT, ALLOWED_UPDATES, POLL_TIMEOUT + 10
+            )
+            errors = 0
+        except Exception as e:
+            errors += 1
+            delay = min(30, 2 ** errors)
+            logging.warning(f"getUpdates failed ({e}); retrying in {delay}s")
+            await asyncio.sleep(delay)
+            continue
+        if not raw:
+            continue
+        await loop.run_in_executor(None, db.journal_updates, raw)
+        task = asyncio.create_task(bot.process_new_updates([types.Update.de_json(u) for u in raw]))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+
+
+async def _run_webhook(bot: AsyncTeleBot):
+    pending = set()
+
+    async def health(request):
+        return web.Response(text="OK")
+
+    async def telegram_webhook(request):
+        try:
+            update = types.Update.de_json(await request.text())
+        except Exception as e:
+            logging.exception(f"Webhook processing error: {e}")
+            return web.Response(status=500, text="ERROR")
+        # Answer Telegram right away; the update is handled in the background
+        task = asyncio.create_task(bot.process_new_updates([update]))
+        pending.add(task)
+        task.add_done_callback(pending.discard)
+        return web.Response(text="OK")
+
+    app = web.Application()
+    app.router.add_get("/health", health)
+    app.router.add_post(f"/{TELEGRAM_BOT_TOKEN}", telegram_webhook)
+
+    webhook_url = WEBHOOK_BASE_URL.rstrip("/") + f"/{TELEGRAM_BOT_TOKEN}"
+    for attempt in range(3):
+        try:
+            await bot.set_webhook(url=webhook_url)
+            break
+        except Exception:
+            try:
+                await bot.delete_webhook()
+            except Exception:
+                pass
+            await asyncio.sleep(1 + attempt)
+    else:
+        await bot.set_webhook(url=webhook_url)
+
+    try:
+        me = await bot.get_me()
+        print(f"Bot started (async), webhook as @{me.username} -> {webhook_url}")
+        await _notify_online(bot, f"Bot @{me.username} is online (async webhook) at {webhook_url}.")
+    except Exception:
+        print("Bot started in async webhook mode.")
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "0.0.0.0", PORT).start()
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+
+async def run_async(sync_bot, db, store):
+    bot = BridgedAsyncTeleBot(TELEGRAM_BOT_TOKEN, sync_bot, parse_mode="HTML")
+    router = Router()
+    client = register_user_handlers_async(bot, db, store, router)
+    router.install(bot)
+    try:
+        if USE_WEBHOOK and WEBHOOK_BASE_URL:
+            await _run_webhook(bot)
+        else:
+            await _run_polling(bot, db)
+    finally:
+        await client.close()
+        await bot.close_session()
@@ -0,0 +1,316 @@
+import csv
+import html
+import io
+import logging
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import List, Tuple
+import telebot
+from telebot import types
+from config import (
+    MAX_TTS_CHARS,
+    COST_PER_VOICE,
+    BATCH_MAX_ITEMS,
+    BATCH_MAX_FILE_BYTES,
+    BATCH_CONCURRENCY,
+    BATCH_VOICES_MAX,
+    BATCH_PROGRESS_INTERVAL,
+)
+from fish_audio import FishAudioClient
+from state_store import make_owner_id
+from user_panel import humanize_text, speed_to_value
+
+BATCH_EXTENSIONS = (".txt", ".csv")
+BATCH_LEASE_TTL = 600
+BATCH_MAX_DELIVERY_ATTEMPTS = 3
+# Edit failures after which the progress message is posted again
+PROGRESS_GONE_ERRORS = ("message to edit not found", "message can't be edited")
+
+
+def is_batch_document(msg: types.Message) -> bool:
+    if msg is None or msg.content_type != "document" or msg.document is None:
+        return False
+    return (msg.document.file_name or "").lower().endswith(BATCH_EXTENSIONS)
+
+
+def is_batch_upload(update: types.Update) -> bool:
+    return is_batch_document(update.message)
+
+
+def parse_batch(file_name: str, data: bytes) -> Tuple[List[str], List[str]]:
+    """
+    Split an upload into texts to voice.
+
+    ``.txt``: one item per non-empty line. ``.csv``: the ``text`` column if the
+    header has one, otherwise the first column. Returns (items, errors).
+    """
+    content = data.decode("utf-8-sig", errors="replace")
+    if file_name.lower().endswith(".csv"):
+        rows = [r for r in csv.reader(io.StringIO(content)) if r and any(c.strip() for c in r)]
+        col = 0
+        if rows:
+            header = [c.strip().lower() for c in rows[0]]
+            if "text" in header:
+                col = header.index("text")
+                rows = rows[1:]
+        raw = [(r[col] if col < len(r) else "") for r in rows]
+    else:
+        raw = content.splitlines()
+
+    items, errors = [], []
+    for line_no, text in enumerate(raw, start=1):
+        text = (text or "").strip()
+        if not text:
+            continue
+        if len(text) > MAX_TTS_CHARS:
+            errors.append(f"Line {line_no}: longer than {MAX_TTS_CHARS} characters")
+            continue
+        items.append(text)
+    if len(items) > BATCH_MAX_ITEMS:
+        errors.append(f"Too many lines: {len(items)} (limit {BATCH_MAX_ITEMS})")
+    return items, errors
+
+
+def progress_text(job_id: int, items) -> str:
+    done = sum(1 for i in items if i["status"] == "done")
+    failed = sum(1 for i in items if i["status"] in ("failed", "skipped"))
+    return f"📦 Batch #{job_id}: {done}/{len(items)} voiced" + (f", {failed} failed" if failed else "")
+
+
+class BatchRunner:
+    """
+    Runs batch jobs in background threads with a shared, bounded synthesis
+    pool. Job and item state live in the database, so unfinished jobs are
+    picked up again by ``resume_pending`` after a restart.
+    """
+
+    def __init__(self, bot: telebot.TeleBot, db, store, state, synthesize):
+        self.bot = bot
+        self.db = db
+        self.store = store
+        self.state = state
+        self.synthesize = synthesize
+        self.pool = ThreadPoolExecutor(max_workers=BATCH_CONCURRENCY, thread_name_prefix="batch")
+        self.owner = make_owner_id()
+        self._active = set()
+        self._active_lock = threading.Lock()
+
+    def start(self, job_id: int):
+        with self._active_lock:
+            if job_id in self._active:
+                return
+            self._active.add(job_id)
+        threading.Thread(target=self._run, args=(job_id,), daemon=True).start()
+
+    def resume_pending(self):
+        for job in self.db.list_running_batch_jobs():
+            self.start(job["id"])
+
+    def start_resume_thread(self, interval_seconds: int = BATCH_LEASE_TTL // 2):
+        """
+        Resume unfinished jobs now and keep retrying: after a deploy the old
+        process's leases stay live until they expire, so a job that cannot be
+        claimed at startup is picked up on a later pass.
+        """
+        def loop():
+            while True:
+                try:
+                    self.resume_pending()
+                except Exception as e:
+                    logging.exception(f"Batch resume failed: {e}")
+                time.sleep(interval_seconds)
+
+        threading.Thread(target=loop, daemon=True).start()
+
+    def _claim(self, job_id: int) -> bool:
+        # Another process may be running the same job after a restart race
+        try:
+            return self.state.acquire_lease(f"batch:{job_id}", self.owner, BATCH_LEASE_TTL)
+        except Exception:
+            return False
+
+    def _update_progress(self, job):
+        text = progress_text(job["id"], self.db.list_batch_items(job["id"]))
+        if text == job.get("progress_text"):
+            return
+        if job.get("progress_message_id"):
+            try:
+                self.bot.edit_message_text(text, job["chat_id"], job["progress_message_id"])
+                job["progress_text"] = text
+                return
+            except Exception as e:
+                error = str(e)
+                if "message is not modified" in error:
+                    job["progress_text"] = text
+                    return
+                if not any(gone in error for gone in PROGRESS_GONE_ERRORS):
+                    # Transient; the next update tries again
+                    logging.warning(f"Batch #{job['id']} progress edit failed: {e}")
+                    return
+        # No progress message yet, or the user deleted it
+        try:
+            msg = self.bot.send_message(job["chat_id"], text)
+            job["progress_message_id"] = msg.message_id
+            job["progress_text"] = text
+            self.db.update_batch_job(job["id"], {"progress_message_id": msg.message_id})
+        except Exception:
+            pass
+
+    def _voice_item(self, job, item):
+        # Reserve before synthesizing so parallel items cannot overspend; an
+        # 'in_progress' item was paid for by a run that did not finish it
+        if item["status"] == "pending" and not self.db.reserve_batch_item(
+            job["id"], item["idx"], job["user_id"], COST_PER_VOICE
+        ):
+            self.db.mark_batch_item(job["id"], item["idx"], "skipped")
+            return
+        try:
+            audio_bytes = self.synthesize(item["text"], job["model"], job["tts_speed"])
+        except Exception as e:
+            logging.warning(f"Batch #{job['id']} item {item['idx']} failed: {e}")
+            self.db.release_batch_item(job["id"], item["idx"], job["user_id"], COST_PER_VOICE)
+            self.db.record_upstream_error(job["model"])
+            return
+        segment, offset, length = self.store.append(audio_bytes)
+        voice_id = self.db.store_voice(
+            job["user_id"], segment=segment, offset=offset, length=length, model=job["model"], chars=len(item["text"])
+        )
+        self.db.mark_batch_item(job["id"], item["idx"], "done", voice_id)
+
+    def _run(self, job_id: int):
+        try:
+            if self._claim(job_id):
+                self._run_claimed(job_id)
+        finally:
+            with self._active_lock:
+                self._active.discard(job_id)
+
+    def _run_claimed(self, job_id: int):
+        job = self.db.get_batch_job(job_id)
+        if not job or job["status"] != "running":
+            return
+        try:
+            pending = [i for i in self.db.list_batch_items(job_id) if i["status"] in ("pending", "in_progress")]
+            self._update_progress(job)
+            futures = [self.pool.submit(self._voice_item, job, item) for item in pending]
+            last_update = time.monotonic()
+            for _ in as_completed(futures):
+                if time.monotonic() - last_update >= BATCH_PROGRESS_INTERVAL:
+                    self._claim(job_id)
+                    self._update_progress(job)
+                    last_update = time.monotonic()
+            self._update_progress(job)
+            # Counted before sending, so a job whose delivery keeps failing
+            # (e.g. the user blocked the bot) is not resumed forever
+            attempts = (job.get("delivery_attempts") or 0) + 1
+            self.db.update_batch_job(job_id, {"delivery_attempts": attempts})
+            try:
+                self._deliver(job)
+            except Exception as e:
+                if attempts < BATCH_MAX_DELIVERY_ATTEMPTS:
+                    raise
+                logging.warning(f"Batch #{job_id}: giving up delivery after {attempts} attempts: {e}")
+                self.db.update_batch_job(job_id, {"status": "failed"})
+                return
+            self.db.update_batch_job(job_id, {"status": "done"})
+        except Exception as e:
+            logging.exception(f"Batch #{job_id} crashed: {e}")
+        finally:
+            try:
+                self.state.release_lease(f"batch:{job_id}", self.owner)
+            except Exception:
+                pass
+
+    def _deliver(self, job):
+        done = [i for i in self.db.list_batch_items(job["id"]) if i["status"] == "done"]
+        if not done:
+            return
+        voices = []
+        for item in done:
+            v = self.db.get_voice(item["voice_id"])
+            if v and v.get("segment"):
+                voices.append((item, self.store.read(v["segment"], v["offset"], v["length"])))
+
+        if job["deliver"] == "voices" and len(voices) <= BATCH_VOICES_MAX:
+            for item, audio in voices:
+                try:
+                    self.bot.send_voice(job["chat_id"], bytes(audio), caption=html.escape(item["text"][:1024]))
+                except Exception as e:
+                    logging.warning(f"Batch #{job['id']} delivery failed for item {item['idx']}: {e}")
+            return
+
+        index = io.StringIO()
+        writer = csv.writer(index)
+        writer.writerow(["file", "text"])
+        buf = io.BytesIO()
+        # Opus is already compressed; store without deflate
+        with zipfile.ZipFile(buf, "w", zipfile.ZIP_STORED) as zf:
+            for item, audio in voices:
+                name = f"{item['idx'] + 1:03d}.ogg"
+                zf.writestr(name, bytes(audio))
+                writer.writerow([name, item["text"]])
+            zf.writestr("index.csv", index.getvalue())
+        buf.seek(0)
+        buf.name = f"batch_{job['id']}.zip"
+        self.bot.send_document(
+            job["chat_id"],
+            buf,
+            caption=f"📦 Batch #{job['id']}: {len(voices)} voices",
+        )
+
+
+def register_batch_handlers(bot: telebot.TeleBot, db, store, state) -> BatchRunner:
+    client = FishAudioClient()
+
+    def synthesize(text: str, model: str, mode: str) -> bytes:
+        return client.synthesize_text(
+            humanize_text(text), model, language="en", format_="opus", speed=speed_to_value(mode), latency="slow"
+        )
+
+    runner = BatchRunner(bot, db, store, state, synthesize)
+
+    @bot.message_handler(content_types=["document"], func=is_batch_document)
+    def batch_upload(message: types.Message):
+        doc = message.document
+        if (doc.file_size or 0) > BATCH_MAX_FILE_BYTES:
+            bot.send_message(message.chat.id, f"File too large. Limit: {BATCH_MAX_FILE_BYTES // 1024} KB.")
+            return
+
+        user = db.get_user(message.from_user.id)
+        if not user:
+            bot.send_message(message.chat.id, "Please send /start first.")
+            return
+        model = user.get("selected_model")
+        if not model:
+            bot.send_message(message.chat.id, "Please select a model first.")
+            return
+
+        try:
+            data = bot.download_file(bot.get_file(doc.file_id).file_path)
+        except Exception as e:
+            bot.send_message(message.chat.id, f"Could not download file: {e}")
+            return
+
+        items, errors = parse_batch(doc.file_name or "", data)
+        if errors:
+            bot.send_message(message.chat.id, "❌ Batch rejected:\n" + "\n".join(errors[:10]))
+            return
+        if not items:
+            bot.send_message(message.chat.id, "No text found in the file.")
+            return
+
+        needed = len(items) * COST_PER_VOICE
+        credits = user.get("credits") or 0
+        if credits < needed:
+            bot.send_message(message.chat.id, f"❌ This batch needs {needed} credits, you have {credits}.")
+            return
+
+        caption = (message.caption or "").lower()
+        deliver = "zip" if "zip" in caption or len(items) > BATCH_VOICES_MAX else "voices"
+        mode = (user.get("tts_speed") or "natural").strip().lower()
+        job_id = db.create_batch_job(message.from_user.id, message.chat.id, model, mode, deliver, items)
+        runner.start(job_id)
+
+    return runner
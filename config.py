@@ -47,3 +47,82 @@ PLANS = [
 USE_WEBHOOK = os.getenv("USE_WEBHOOK", "false").lower() == "true"
 WEBHOOK_BASE_URL = os.getenv("WEBHOOK_BASE_URL", "")
 PORT = int(os.getenv("PORT", "8000"))
+
+# Update dispatch lanes (worker threads per lane)
+LANE_INTERACTIVE_WORKERS = int(os.getenv("LANE_INTERACTIVE_WORKERS", "4"))
+LANE_HEAVY_WORKERS = int(os.getenv("LANE_HEAVY_WORKERS", "8"))
+LANE_ADMIN_WORKERS = int(os.getenv("LANE_ADMIN_WORKERS", "2"))
+
+# Shared conversation state / singleton leases (lets several processes share one webhook)
+STATE_BACKEND = os.getenv("STATE_BACKEND", "sqlite")
+STATE_DB_PATH = os.getenv("STATE_DB_PATH", DB_PATH)
+ADMIN_STEP_TTL = int(os.getenv("ADMIN_STEP_TTL", "900"))
+
+# asyncio runtime (AsyncTeleBot + aiohttp; voice-store writes run in the default executor)
+ASYNC_MODE = os.getenv("ASYNC_MODE", "false").lower() == "true"
+FISH_AUDIO_MAX_CONNECTIONS = int(os.getenv("FISH_AUDIO_MAX_CONNECTIONS", "100"))
+
+# Append-only voice pack files under VOICES_DIR/segments
+VOICE_SEGMENT_MAX_BYTES = int(os.getenv("VOICE_SEGMENT_MAX_BYTES", str(64 * 1024 * 1024)))
+VOICE_COMPACT_MIN_DEAD_RATIO = float(os.getenv("VOICE_COMPACT_MIN_DEAD_RATIO", "0.5"))
+VOICE_COMPACT_INTERVAL = int(os.getenv("VOICE_COMPACT_INTERVAL", str(6 * 3600)))
+# Segments written to more recently than this are never compacted
+VOICE_COMPACT_GRACE_SECONDS = int(os.getenv("VOICE_COMPACT_GRACE_SECONDS", "600"))
+
+# Voice retention per plan tier: users with is_premium=1 use "premium", everyone else "free".
+# None disables a limit.
+RETENTION_POLICIES = {
+    "free": {"max_voices": 50, "max_age_days": 30, "max_bytes": 20 * 1024 * 1024},
+    "premium": {"max_voices": 1000, "max_age_days": 180, "max_bytes": 500 * 1024 * 1024},
+}
+
+# Database / volume maintenance, run inside the quiet-hours window (UTC, start-end)
+MAINTENANCE_QUIET_HOURS = os.getenv("MAINTENANCE_QUIET_HOURS", "2-5")
+MAINTENANCE_INTERVAL = int(os.getenv("MAINTENANCE_INTERVAL", "3600"))
+MAINTENANCE_BATCH_SIZE = int(os.getenv("MAINTENANCE_BATCH_SIZE", "500"))
+MAINTENANCE_VACUUM_PAGES = int(os.getenv("MAINTENANCE_VACUUM_PAGES", "5000"))
+
+# Request tracing: share of requests timed per stage, slow threshold and buffer size
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.5"))
+TRACE_SLOW_MS = int(os.getenv("TRACE_SLOW_MS", "5000"))
+TRACE_BUFFER_SIZE = int(os.getenv("TRACE_BUFFER_SIZE", "200"))
+
+# Batch synthesis from uploaded .txt/.csv files
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "100"))
+BATCH_MAX_FILE_BYTES = int(os.getenv("BATCH_MAX_FILE_BYTES", str(256 * 1024)))
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "3"))
+BATCH_VOICES_MAX = int(os.getenv("BATCH_VOICES_MAX", "10"))      # larger batches are delivered as one zip
+BATCH_PROGRESS_INTERVAL = int(os.getenv("BATCH_PROGRESS_INTERVAL", "3"))
+
+# Outbound Telegram pacing (Bot API allows ~1 msg/s per chat and ~30 msg/s overall)
+TG_PER_CHAT_INTERVAL = float(os.getenv("TG_PER_CHAT_INTERVAL", "1.0"))
+TG_GLOBAL_RATE = float(os.getenv("TG_GLOBAL_RATE", "25"))
+TG_MAX_RETRIES = int(os.getenv("TG_MAX_RETRIES", "3"))
+
+# Pre-synthesized phrase library (built during MAINTENANCE_QUIET_HOURS)
+PHRASE_PROMOTE_MIN_HITS = int(os.getenv("PHRASE_PROMOTE_MIN_HITS", "20"))
+PHRASE_PROMOTE_LIMIT = int(os.getenv("PHRASE_PROMOTE_LIMIT", "20"))
+PHRASE_SYNTH_PER_MINUTE = int(os.getenv("PHRASE_SYNTH_PER_MINUTE", "20"))
+PHRASE_INTERVAL = int(os.getenv("PHRASE_INTERVAL", "600"))
+# Request texts counted for promotion are forgotten after this many days
+# unseen, and at most TEXT_COUNTS_MAX_ROWS are kept
+TEXT_COUNTS_KEEP_DAYS = int(os.getenv("TEXT_COUNTS_KEEP_DAYS", "7"))
+TEXT_COUNTS_MAX_ROWS = int(os.getenv("TEXT_COUNTS_MAX_ROWS", "50000"))
+
+# Admin membership is cached in memory and reloaded after this many seconds
+ADMIN_CACHE_TTL = int(os.getenv("ADMIN_CACHE_TTL", "60"))
+
+# Long polling: updates per getUpdates call, long-poll timeout (seconds) and
+# how many chats are worked through in parallel when draining the backlog after a restart
+POLL_BATCH_SIZE = min(100, max(1, int(os.getenv("POLL_BATCH_SIZE", "100"))))
+POLL_TIMEOUT = int(os.getenv("POLL_TIMEOUT", "30"))
+POLL_BACKLOG_CONCURRENCY = int(os.getenv("POLL_BACKLOG_CONCURRENCY", "4"))
+
+# Inline mode (@bot <text> in any chat). Voices are uploaded once to
+# INLINE_UPLOAD_CHAT_ID to get a reusable file_id; use a private channel the
+# bot administers (the fallback, the first admin, must have started the bot).
+INLINE_DEBOUNCE_MS = int(os.getenv("INLINE_DEBOUNCE_MS", "700"))
+INLINE_WORKERS = int(os.getenv("INLINE_WORKERS", "4"))
+INLINE_CACHE_TIME = int(os.getenv("INLINE_CACHE_TIME", "30"))
+INLINE_UPLOAD_CHAT_ID = int(os.getenv("INLINE_UPLOAD_CHAT_ID", "0") or 0) or (ADMIN_IDS[0] if ADMIN_IDS else 0)
+INLINE_CACHE_KEEP_DAYS = int(os.getenv("INLINE_CACHE_KEEP_DAYS", "30"))
@@ -1,12 +1,18 @@
+import json
 import sqlite3
+import threading
 from datetime import datetime, timedelta
 from typing import List, Optional, Dict, Any
 
 
 class Database:
     def __init__(self, path: str):
+        self.path = path
         self.conn = sqlite3.connect(path, check_same_thread=False)
         self.conn.row_factory = sqlite3.Row
+        # Every write method holds this while it runs, so a commit from one
+        # thread never lands inside another thread's transaction on the shared connection
+        self.lock = threading.RLock()
         self._init_schema()
 
     def _init_schema(self):
@@ -50,19 +56,164 @@ class Database:
         except Exception:
             pass
 
-        self.conn.commit()
+        # Pack-file voice storage: location inside an append-only segment.
+        for column in ("segment TEXT", "offset INTEGER", "length INTEGER"):
+            try:
+                cur.execute(f"ALTER TABLE voices ADD COLUMN {column}")
+            except Exception:
+                pass
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_voices_user ON voices (user_id)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_voices_segment ON voices (segment)")
 
-    def ensure_user(self, user_id: int, username: Optional[str]):
-        cur = self.conn.cursor()
-        cur.execute("SELECT id FROM users WHERE id = ?", (user_id,))
-        row = cur.fetchone()
-        now = datetime.utcnow().isoformat()
-        if not row:
+        # Statistics rollups, updated in the same transaction as the event they count.
+        for table in ("stats_hourly", "stats_daily"):
             cur.execute(
-                "INSERT INTO users (id, username, is_premium, credits, tts_speed, created_at, updated_at) VALUES (?, ?, 0, 0, ?, ?, ?)",
-                (user_id, username, "natural", now, now),
+                f"""
+                CREATE TABLE IF NOT EXISTS {table} (
+                    bucket TEXT NOT NULL,
+                    metric TEXT NOT NULL,
+                    dim TEXT NOT NULL DEFAULT '',
+                    value INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (bucket, metric, dim)
+                )
+                """
             )
-            self.conn.commit()
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS batch_jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER,
+                chat_id INTEGER,
+                model TEXT,
+                tts_speed TEXT,
+                deliver TEXT,
+                status TEXT,
+                progress_message_id INTEGER,
+                delivery_attempts INTEGER DEFAULT 0,
+                created_at TEXT,
+                updated_at TEXT
+            )
+            """
+        )
+        try:
+            cur.execute("ALTER TABLE batch_jobs ADD COLUMN delivery_attempts INTEGER DEFAULT 0")
+        except Exception:
+            pass
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS batch_items (
+                job_id INTEGER,
+                idx INTEGER,
+                text TEXT,
+                status TEXT DEFAULT 'pending',
+                voice_id INTEGER,
+                was_premium INTEGER,
+                PRIMARY KEY (job_id, idx)
+            )
+            """
+        )
+        # is_premium before the item's reservation, restored if it is refunded
+        try:
+            cur.execute("ALTER TABLE batch_items ADD COLUMN was_premium INTEGER")
+        except Exception:
+            pass
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS phrases (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                text_key TEXT UNIQUE,
+                text TEXT,
+                source TEXT,
+                created_at TEXT
+            )
+            """
+        )
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS phrase_audio (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                phrase_id INTEGER,
+                model TEXT,
+                tts_speed TEXT,
+                segment TEXT,
+                offset INTEGER,
+                length INTEGER,
+                file_id TEXT,
+                created_at TEXT,
+                UNIQUE (phrase_id, model, tts_speed)
+            )
+            """
+        )
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS text_counts (
+                text_key TEXT PRIMARY KEY,
+                text TEXT,
+                hits INTEGER DEFAULT 0,
+                last_seen TEXT
+            )
+            """
+        )
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS inline_voices (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                text_key TEXT,
+                model TEXT,
+                tts_speed TEXT,
+                file_id TEXT,
+                segment TEXT,
+                offset INTEGER,
+                length INTEGER,
+                created_at TEXT,
+                last_used_at TEXT,
+                UNIQUE (text_key, model, tts_speed)
+            )
+            """
+        )
+        # Long-polling journal: last fetched update_id and fetched updates not yet handled.
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS polling_offset (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                update_id INTEGER NOT NULL
+            )
+            """
+        )
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS pending_updates (
+                update_id INTEGER PRIMARY KEY,
+                payload TEXT,
+                received_at TEXT
+            )
+            """
+        )
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS stats_active (
+                bucket TEXT NOT NULL,
+                user_id INTEGER NOT NULL,
+                PRIMARY KEY (bucket, user_id)
+            )
+            """
+        )
+
+        self.conn.commit()
+
+    def ensure_user(self, user_id: int, username: Optional[str]):
+        with self.lock:
+            cur = self.conn.cursor()
+            cur.execute("SELECT id FROM users WHERE id = ?", (user_id,))
+            row = cur.fetchone()
+            now = datetime.utcnow().isoformat()
+            if not row:
+                cur.execute(
+                    "INSERT INTO users (id, username, is_premium, credits, tts_speed, created_at, updated_at) VALUES (?, ?, 0, 0, ?, ?, ?)",
+                    (user_id, username, "natural", now, now),
+                )
+                self._bump_stats(cur, [("new_users", "", 1)])
+                self.conn.commit()
 
     def get_user(self, user_id: int) -> Optional[Dict[str, Any]]:
         cur = self.conn.cursor()
@@ -71,31 +222,57 @@ class Database:
         return dict(row) if row else None
 
     def update_user_fields(self, user_id: int, fields: Dict[str, Any]):
-        if not fields:
-            return
-        fields["updated_at"] = datetime.utcnow().isoformat()
-        keys = list(fields.keys())
-        values = [fields[k] for k in keys]
-        set_clause = ", ".join([f"{k} = ?" for k in keys])
-        cur = self.conn.cursor()
-        cur.execute(f"UPDATE users SET {set_clause} WHERE id = ?", (*values, user_id))
-        self.conn.commit()
+        with self.lock:
+            if not fields:
+                return
+            fields["updated_at"] = datetime.utcnow().isoformat()
+            keys = list(fields.keys())
+            values = [fields[k] for k in keys]
+            set_clause = ", ".join([f"{k} = ?" for k in keys])
+            cur = self.conn.cursor()
+            cur.execute(f"UPDATE users SET {set_clause} WHERE id = ?", (*values, user_id))
+            self.conn.commit()
 
     def add_credits(self, user_id: int, amount: int):
-        cur = self.conn.cursor()
+        with self.lock:
+            cur = self.conn.cursor()
+            cur.execute(
+                "UPDATE users SET credits = COALESCE(credits,0) + ?, is_premium = 1, updated_at = ? WHERE id = ?",
+                (amount, datetime.utcnow().isoformat(), user_id),
+            )
+            self._bump_stats(cur, [("credits_added", "", amount)])
+            self.conn.commit()
+
+    def remove_credits(self, user_id: int, amount: int, consumed: bool = False):
+        """Take credits away; ``consumed`` marks them as spent on synthesis for the stats rollups."""
+        with self.lock:
+            user = self.get_user(user_id)
+            if not user:
+                return
+            credits = int(user.get("credits") or 0)
+            new_credits = max(0, credits - amount)
+            is_premium = 1 if new_credits > 0 and self.is_valid(user_id) else 0
+            cur = self.conn.cursor()
+            cur.execute(
+                "UPDATE users SET credits = ?, is_premium = ?, updated_at = ? WHERE id = ?",
+                (new_credits, is_premium, datetime.utcnow().isoformat(), user_id),
+            )
+            if consumed:
+                self._bump_stats(cur, [("credits_consumed", "", credits - new_credits)])
+            self.conn.commit()
+
+    def _take_credits(self, cur, user_id: int, amount: int) -> bool:
+        """Take ``amount`` credits and count them as consumed, in the caller's transaction."""
         cur.execute(
-            "UPDATE users SET credits = COALESCE(credits,0) + ?, is_premium = 1, updated_at = ? WHERE id = ?",
-            (amount, datetime.utcnow().isoformat(), user_id),
+            "UPDATE users SET credits = credits - ?, "
+            "is_premium = CASE WHEN credits - ? > 0 THEN is_premium ELSE 0 END, updated_at = ? "
+            "WHERE id = ? AND COALESCE(credits, 0) >= ?",
+            (amount, amount, datetime.utcnow().isoformat(), user_id, amount),
         )
-        self.conn.commit()
-
-    def remove_credits(self, user_id: int, amount: int):
-        user = self.get_user(user_id)
-        if not user:
-            return
-        new_credits = max(0, int(user.get("credits") or 0) - amount)
-        is_premium = 1 if new_credits > 0 and self.is_valid(user_id) else 0
-        self.update_user_fields(user_id, {"credits": new_credits, "is_premium": is_premium})
+        if cur.rowcount != 1:
+            return False
+        self._bump_stats(cur, [("credits_consumed", "", amount)])
+        return True
 
     def set_validity(self, user_id: int, days: int):
         expire_at = (datetime.utcnow() + timedelta(days=days)).isoformat()
@@ -136,13 +313,72 @@ class Database:
         rows = cur.fetchall()
         return [dict(r) for r in rows]
 
-    def store_voice(self, user_id: int, file_path: str):
+    def store_voice(
+        self,
+        user_id: int,
+        file_path: Optional[str] = None,
+        segment: Optional[str] = None,
+        offset: Optional[int] = None,
+        length: Optional[int] = None,
+        model: Optional[str] = None,
+        chars: int = 0,
+    ):
+        with self.lock:
+            cur = self.conn.cursor()
+            cur.execute(
+                "INSERT INTO voices (user_id, file_path, segment, offset, length, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (user_id, file_path, segment, offset, length, datetime.utcnow().isoformat()),
+            )
+            voice_id = cur.lastrowid
+            self._mark_active(cur, user_id)
+            self._bump_stats(cur, [("voices", model or "", 1), ("chars", model or "", chars)])
+            self.conn.commit()
+            return voice_id
+
+    def get_voice(self, voice_id: int) -> Optional[Dict[str, Any]]:
+        cur = self.conn.cursor()
+        cur.execute("SELECT * FROM voices WHERE id = ?", (voice_id,))
+        row = cur.fetchone()
+        return dict(row) if row else None
+
+    def count_user_voices(self, user_id: int) -> int:
+        cur = self.conn.cursor()
+        cur.execute("SELECT COUNT(*) FROM voices WHERE user_id = ?", (user_id,))
+        return int(cur.fetchone()[0])
+
+    # Tables whose rows point into voice pack segments
+    SEGMENT_REF_TABLES = ("voices", "phrase_audio", "inline_voices")
+
+    def voice_segment_live_bytes(self) -> Dict[str, int]:
         cur = self.conn.cursor()
         cur.execute(
-            "INSERT INTO voices (user_id, file_path, created_at) VALUES (?, ?, ?)",
-            (user_id, file_path, datetime.utcnow().isoformat()),
+            "SELECT segment, SUM(length) FROM ("
+            " SELECT DISTINCT segment, offset, length FROM voices WHERE segment IS NOT NULL"
+            " UNION SELECT segment, offset, length FROM phrase_audio WHERE segment IS NOT NULL"
+            " UNION SELECT segment, offset, length FROM inline_voices WHERE segment IS NOT NULL"
+            ") GROUP BY segment"
         )
-        self.conn.commit()
+        return {r[0]: int(r[1] or 0) for r in cur.fetchall()}
+
+    def list_segment_voices(self, segment: str) -> List[Dict[str, Any]]:
+        """Every row pointing into ``segment``; several rows may share one (offset, length)."""
+        cur = self.conn.cursor()
+        cur.execute(
+            "SELECT 'voices' AS tbl, id, offset, length FROM voices WHERE segment = ? "
+            "UNION ALL SELECT 'phrase_audio' AS tbl, id, offset, length FROM phrase_audio WHERE segment = ? "
+            "UNION ALL SELECT 'inline_voices' AS tbl, id, offset, length FROM inline_voices WHERE segment = ? "
+            "ORDER BY offset",
+            (segment, segment, segment),
+        )
+        return [dict(r) for r in cur.fetchall()]
+
+    def update_voice_location(self, voice_id: int, segment: str, offset: int, table: str = "voices"):
+        with self.lock:
+            if table not in self.SEGMENT_REF_TABLES:
+                raise ValueError(f"Unknown segment table: {table}")
+            cur = self.conn.cursor()
+            cur.execute(f"UPDATE {table} SET segment = ?, offset = ? WHERE id = ?", (segment, offset, voice_id))
+            self.conn.commit()
 
     def list_user_voices(self, user_id: int) -> List[Dict[str, Any]]:
         cur = self.conn.cursor()
@@ -151,9 +387,429 @@ class Database:
         return [dict(r) for r in rows]
 
     def delete_user_voices(self, user_id: int):
+        with self.lock:
+            cur = self.conn.cursor()
+            cur.execute("DELETE FROM voices WHERE user_id = ?", (user_id,))
+            self.conn.commit()
+
+    def list_voice_owner_ids(self) -> List[int]:
         cur = self.conn.cursor()
-        cur.execute("DELETE FROM voices WHERE user_id = ?", (user_id,))
-        self.conn.commit()
+        cur.execute("SELECT DISTINCT user_id FROM voices")
+        return [int(r[0]) for r in cur.fetchall()]
+
+    def list_voice_sizes(self, user_id: int) -> List[Dict[str, Any]]:
+        """Newest first: id, created_at, length and legacy file_path of each voice."""
+        cur = self.conn.cursor()
+        cur.execute(
+            "SELECT id, created_at, length, file_path FROM voices WHERE user_id = ? ORDER BY created_at DESC, id DESC",
+            (user_id,),
+        )
+        return [dict(r) for r in cur.fetchall()]
+
+    def delete_voices(self, voice_ids: List[int]):
+        with self.lock:
+            if not voice_ids:
+                return
+            cur = self.conn.cursor()
+            cur.execute(f"DELETE FROM voices WHERE id IN ({','.join('?' * len(voice_ids))})", voice_ids)
+            self.conn.commit()
+
+    def file_size_bytes(self) -> int:
+        cur = self.conn.cursor()
+        page_count = cur.execute("PRAGMA page_count").fetchone()[0]
+        page_size = cur.execute("PRAGMA page_size").fetchone()[0]
+        return int(page_count) * int(page_size)
+
+    def run_maintenance(self, vacuum_pages: int) -> Dict[str, int]:
+        """
+        Incremental vacuum, ANALYZE and WAL checkpoint; returns database bytes
+        reclaimed. Runs on its own autocommit connection: VACUUM cannot run
+        inside a transaction, which the shared connection may have open for
+        another thread. The first run on a database created without
+        incremental auto_vacuum does one full VACUUM to switch modes; it
+        rewrites the whole file and holds the write lock while it does.
+        """
+        before = self.file_size_bytes()
+        conn = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+        try:
+            if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+                conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+                conn.execute("VACUUM")
+            conn.execute(f"PRAGMA incremental_vacuum({int(vacuum_pages)})").fetchall()
+            conn.execute("ANALYZE")
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchall()
+        finally:
+            conn.close()
+        return {"db_bytes_before": before, "db_bytes_reclaimed": max(0, before - self.file_size_bytes())}
+
+    # -------------------------
+    # Batch synthesis jobs
+    # -------------------------
+    def create_batch_job(self, user_id: int, chat_id: int, model: str, tts_speed: str, deliver: str, texts: List[str]) -> int:
+        with self.lock:
+            now = datetime.utcnow().isoformat()
+            cur = self.conn.cursor()
+            cur.execute(
+                "INSERT INTO batch_jobs (user_id, chat_id, model, tts_speed, deliver, status, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, 'running', ?, ?)",
+                (user_id, chat_id, model, tts_speed, deliver, now, now),
+            )
+            job_id = cur.lastrowid
+            cur.executemany(
+                "INSERT INTO batch_items (job_id, idx, text) VALUES (?, ?, ?)",
+                [(job_id, i, t) for i, t in enumerate(texts)],
+            )
+            self.conn.commit()
+            return job_id
+
+    def get_batch_job(self, job_id: int) -> Optional[Dict[str, Any]]:
+        cur = self.conn.cursor()
+        cur.execute("SELECT * FROM batch_jobs WHERE id = ?", (job_id,))
+        row = cur.fetchone()
+        return dict(row) if row else None
+
+    def list_running_batch_jobs(self) -> List[Dict[str, Any]]:
+        cur = self.conn.cursor()
+        cur.execute("SELECT * FROM batch_jobs WHERE status = 'running' ORDER BY id")
+        return [dict(r) for r in cur.fetchall()]
+
+    def update_batch_job(self, job_id: int, fields: Dict[str, Any]):
+        with self.lock:
+            fields["updated_at"] = datetime.utcnow().isoformat()
+            keys = list(fields.keys())
+            set_clause = ", ".join([f"{k} = ?" for k in keys])
+            cur = self.conn.cursor()
+            cur.execute(f"UPDATE batch_jobs SET {set_clause} WHERE id = ?", (*[fields[k] for k in keys], job_id))
+            self.conn.commit()
+
+    def list_batch_items(self, job_id: int) -> List[Dict[str, Any]]:
+        cur = self.conn.cursor()
+        cur.execute("SELECT * FROM batch_items WHERE job_id = ? ORDER BY idx", (job_id,))
+        return [dict(r) for r in cur.fetchall()]
+
+    def reserve_batch_item(self, job_id: int, idx: int, user_id: int, amount: int) -> bool:
+        """
+        Take the credits for a pending item and mark it 'in_progress' in one
+        transaction, so a crash can neither charge an item twice nor lose the
+        charge. Returns False if the user is out of credits.
+        """
+        with self.lock:
+            cur = self.conn.cursor()
+            cur.execute("SELECT status FROM batch_items WHERE job_id = ? AND idx = ?", (job_id, idx))
+            row = cur.fetchone()
+            if not row or row["status"] != "pending":
+                # Already reserved by an earlier run
+                return True
+            cur.execute("SELECT COALESCE(is_premium, 0) FROM users WHERE id = ?", (user_id,))
+            user = cur.fetchone()
+            if not user or not self._take_credits(cur, user_id, amount):
+                return False
+            cur.execute(
+                "UPDATE batch_items SET status = 'in_progress', was_premium = ? WHERE job_id = ? AND idx = ?",
+                (user[0], job_id, idx),
+            )
+            self.conn.commit()
+            return True
+
+    def release_batch_item(self, job_id: int, idx: int, user_id: int, amount: int):
+        """
+        Refund a reserved item whose synthesis failed and mark it 'failed', in
+        one transaction. A reservation that emptied the balance also cleared
+        is_premium; the value from before the reservation is put back.
+        """
+        with self.lock:
+            cur = self.conn.cursor()
+            cur.execute("SELECT was_premium FROM batch_items WHERE job_id = ? AND idx = ?", (job_id, idx))
+            row = cur.fetchone()
+            was_premium = (row["was_premium"] or 0) if row else 0
+            cur.execute(
+                "UPDATE users SET credits = COALESCE(credits, 0) + ?, "
+                "is_premium = MAX(COALESCE(is_premium, 0), ?), updated_at = ? WHERE id = ?",
+                (amount, was_premium, datetime.utcnow().isoformat(), user_id),
+            )
+            self._bump_stats(cur, [("credits_consumed", "", -amount)])
+            cur.execute("UPDATE batch_items SET status = 'failed' WHERE job_id = ? AND idx = ?", (job_id, idx))
+            self.conn.commit()
+
+    def mark_batch_item(self, job_id: int, idx: int, status: str, voice_id: Optional[int] = None):
+        with self.lock:
+            cur = self.conn.cursor()
+            cur.execute(
+                "UPDATE batch_items SET status = ?, voice_id = ? WHERE job_id = ? AND idx = ?",
+                (status, voice_id, job_id, idx),
+            )
+            self.conn.commit()
+
+    def get_phrase_audio_by_id(self, phrase_audio_id: int) -> Optional[Dict[str, Any]]:
+        cur = self.conn.cursor()
+        cur.execute("SELECT * FROM phrase_audio WHERE id = ?", (phrase_audio_id,))
+        row = cur.fetchone()
+        return dict(row) if row else None
+
+    # -------------------------
+    # Inline-mode voice cache
+    # -------------------------
+    def get_inline_voice(self, text_key: str, model: str, tts_speed: str) -> Optional[Dict[str, Any]]:
+        cur = self.conn.cursor()
+        cur.execute(
+            "SELECT * FROM inline_voices WHERE text_key = ? AND model = ? AND tts_speed = ?",
+            (text_key, model, tts_speed),
+        )
+        row = cur.fetchone()
+        return dict(row) if row else None
+
+    def get_inline_voice_by_id(self, inline_voice_id: int) -> Optional[Dict[str, Any]]:
+        cur = self.conn.cursor()
+        cur.execute("SELECT * FROM inline_voices WHERE id = ?", (inline_voice_id,))
+        row = cur.fetchone()
+        return dict(row) if row else None
+
+    def store_inline_voice(
+        self, text_key: str, model: str, tts_speed: str, file_id: str, segment: str, offset: int, length: int
+    ) -> int:
+        with self.lock:
+            now = datetime.utcnow().isoformat()
+            cur = self.conn.cursor()
+            cur.execute(
+                "INSERT INTO inline_voices (text_key, model, tts_speed, file_id, segment, offset, length, created_at, last_used_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(text_key, model, tts_speed) DO UPDATE SET file_id = excluded.file_id, "
+                "segment = excluded.segment, offset = excluded.offset, length = excluded.length",
+                (text_key, model, tts_speed, file_id, segment, offset, length, now, now),
+            )
+            cur.execute(
+                "SELECT id FROM inline_voices WHERE text_key = ? AND model = ? AND tts_speed = ?",
+                (text_key, model, tts_speed),
+            )
+            inline_voice_id = int(cur.fetchone()[0])
+            self.conn.commit()
+            return inline_voice_id
+
+    def touch_inline_voice(self, inline_voice_id: int):
+        with self.lock:
+            cur = self.conn.cursor()
+            cur.execute(
+                "UPDATE inline_voices SET last_used_at = ? WHERE id = ?", (datetime.utcnow().isoformat(), inline_voice_id)
+            )
+            self.conn.commit()
+
+    def prune_inline_voices(self, keep_days: int) -> int:
+        """Forget inline voices nobody has sent for ``keep_days``; their audio is reclaimed by compaction."""
+        with self.lock:
+            cutoff = (datetime.utcnow() - timedelta(days=keep_days)).isoformat()
+            cur = self.conn.cursor()
+            cur.execute("DELETE FROM inline_voices WHERE last_used_at < ?", (cutoff,))
+            self.conn.commit()
+            return cur.rowcount
+
+    # -------------------------
+    # Polling offset / update journal
+    # -------------------------
+    def get_update_offset(self) -> int:
+        cur = self.conn.cursor()
+        cur.execute("SELECT update_id FROM polling_offset WHERE id = 1")
+        row = cur.fetchone()
+        return int(row[0]) if row else 0
+
+    def journal_updates(self, raw_updates: List[Dict[str, Any]]) -> int:
+        """Store fetched updates and advance the offset in one transaction; returns the new offset."""
+        with self.lock:
+            offset = self.get_update_offset()
+            if not raw_updates:
+                return offset
+            now = datetime.utcnow().isoformat()
+            cur = self.conn.cursor()
+            cur.executemany(
+                "INSERT OR IGNORE INTO pending_updates (update_id, payload, received_at) VALUES (?, ?, ?)",
+                [(u["update_id"], json.dumps(u), now) for u in raw_updates],
+            )
+            offset = max([offset] + [u["update_id"] for u in raw_updates])
+            cur.execute(
+                "INSERT INTO polling_offset (id, update_id) VALUES (1, ?) "
+                "ON CONFLICT(id) DO UPDATE SET update_id = excluded.update_id",
+                (offset,),
+            )
+            self.conn.commit()
+            return offset
+
+    def list_pending_updates(self) -> List[Dict[str, Any]]:
+        cur = self.conn.cursor()
+        cur.execute("SELECT payload FROM pending_updates ORDER BY update_id")
+        return [json.loads(r[0]) for r in cur.fetchall()]
+
+    def finish_updates(self, update_ids: List[int]):
+        with self.lock:
+            cur = self.conn.cursor()
+            cur.executemany("DELETE FROM pending_updates WHERE update_id = ?", [(i,) for i in update_ids])
+            self.conn.commit()
+
+    # -------------------------
+    # Phrase library
+    # -------------------------
+    def add_phrase(self, text_key: str, text: str, source: str) -> Optional[int]:
+        with self.lock:
+            cur = self.conn.cursor()
+            cur.execute(
+                "INSERT OR IGNORE INTO phrases (text_key, text, source, created_at) VALUES (?, ?, ?, ?)",
+                (text_key, text, source, datetime.utcnow().isoformat()),
+            )
+            self.conn.commit()
+            return cur.lastrowid if cur.rowcount == 1 else None
+
+    def list_phrases(self, limit: int = -1, offset: int = 0) -> List[Dict[str, Any]]:
+        cur = self.conn.cursor()
+        cur.execute(
+            "SELECT p.*, COUNT(a.id) AS ready FROM phrases p LEFT JOIN phrase_audio a ON a.phrase_id = p.id "
+            "GROUP BY p.id ORDER BY p.id LIMIT ? OFFSET ?",
+            (limit, offset),
+        )
+        return [dict(r) for r in cur.fetchall()]
+
+    def count_phrases(self) -> int:
+        cur = self.conn.cursor()
+        cur.execute("SELECT COUNT(*) FROM phrases")
+        return int(cur.fetchone()[0])
+
+    def delete_phrase(self, phrase_id: int):
+        with self.lock:
+            cur = self.conn.cursor()
+            cur.execute("DELETE FROM phrase_audio WHERE phrase_id = ?", (phrase_id,))
+            cur.execute("DELETE FROM phrases WHERE id = ?", (phrase_id,))
+            self.conn.commit()
+
+    def get_phrase_audio(self, text_key: str, model: str, tts_speed: str) -> Optional[Dict[str, Any]]:
+        cur = self.conn.cursor()
+        cur.execute(
+            "SELECT a.* FROM phrase_audio a JOIN phrases p ON p.id = a.phrase_id "
+            "WHERE p.text_key = ? AND a.model = ? AND a.tts_speed = ?",
+            (text_key, model, tts_speed),
+        )
+        row = cur.fetchone()
+        return dict(row) if row else None
+
+    def has_phrase_audio(self, phrase_id: int, model: str, tts_speed: str) -> bool:
+        cur = self.conn.cursor()
+        cur.execute(
+            "SELECT 1 FROM phrase_audio WHERE phrase_id = ? AND model = ? AND tts_speed = ?",
+            (phrase_id, model, tts_speed),
+        )
+        return cur.fetchone() is not None
+
+    def store_phrase_audio(self, phrase_id: int, model: str, tts_speed: str, segment: str, offset: int, length: int):
+        with self.lock:
+            cur = self.conn.cursor()
+            cur.execute(
+                "INSERT OR REPLACE INTO phrase_audio (phrase_id, model, tts_speed, segment, offset, length, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (phrase_id, model, tts_speed, segment, offset, length, datetime.utcnow().isoformat()),
+            )
+            self.conn.commit()
+
+    def set_phrase_file_id(self, phrase_audio_id: int, file_id: str):
+        with self.lock:
+            cur = self.conn.cursor()
+            cur.execute("UPDATE phrase_audio SET file_id = ? WHERE id = ?", (file_id, phrase_audio_id))
+            self.conn.commit()
+
+    def count_text(self, text_key: str, text: str):
+        with self.lock:
+            cur = self.conn.cursor()
+            cur.execute(
+                "INSERT INTO text_counts (text_key, text, hits, last_seen) VALUES (?, ?, 1, ?) "
+                "ON CONFLICT(text_key) DO UPDATE SET hits = hits + 1, last_seen = excluded.last_seen",
+                (text_key, text, datetime.utcnow().isoformat()),
+            )
+            self.conn.commit()
+
+    def top_unpromoted_texts(self, min_hits: int, limit: int) -> List[Dict[str, Any]]:
+        cur = self.conn.cursor()
+        cur.execute(
+            "SELECT c.text_key, c.text, c.hits FROM text_counts c "
+            "LEFT JOIN phrases p ON p.text_key = c.text_key "
+            "WHERE p.id IS NULL AND c.hits >= ? ORDER BY c.hits DESC LIMIT ?",
+            (min_hits, limit),
+        )
+        return [dict(r) for r in cur.fetchall()]
+
+    def prune_text_counts(self, keep_days: int, max_rows: int):
+        """
+        Forget request texts not seen for ``keep_days``, however often they
+        were asked for, then keep only the ``max_rows`` most requested.
+        Promoted texts live on in ``phrases``, so nothing here is kept forever.
+        """
+        with self.lock:
+            cutoff = (datetime.utcnow() - timedelta(days=keep_days)).isoformat()
+            cur = self.conn.cursor()
+            cur.execute("DELETE FROM text_counts WHERE last_seen < ?", (cutoff,))
+            cur.execute(
+                "DELETE FROM text_counts WHERE text_key NOT IN "
+                "(SELECT text_key FROM text_counts ORDER BY hits DESC, last_seen DESC LIMIT ?)",
+                (max_rows,),
+            )
+            self.conn.commit()
+
+    # -------------------------
+    # Statistics rollups
+    # -------------------------
+    @staticmethod
+    def _buckets(when: datetime):
+        return when.strftime("%Y-%m-%dT%H"), when.strftime("%Y-%m-%d")
+
+    def _bump_stats(self, cur, increments, when: Optional[datetime] = None):
+        hour, day = self._buckets(when or datetime.utcnow())
+        for metric, dim, value in increments:
+            if not value:
+                continue
+            for table, bucket in (("stats_hourly", hour), ("stats_daily", day)):
+                cur.execute(
+                    f"INSERT INTO {table} (bucket, metric, dim, value) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT(bucket, metric, dim) DO UPDATE SET value = value + excluded.value",
+                    (bucket, metric, dim, value),
+                )
+
+    def _mark_active(self, cur, user_id: int):
+        """Count ``user_id`` once per hour and once per day in active_users."""
+        hour, day = self._buckets(datetime.utcnow())
+        for bucket in (hour, day):
+            cur.execute("INSERT OR IGNORE INTO stats_active (bucket, user_id) VALUES (?, ?)", (bucket, user_id))
+            if cur.rowcount == 1:
+                table = "stats_hourly" if bucket == hour else "stats_daily"
+                cur.execute(
+                    f"INSERT INTO {table} (bucket, metric, dim, value) VALUES (?, 'active_users', '', 1) "
+                    "ON CONFLICT(bucket, metric, dim) DO UPDATE SET value = value + 1",
+                    (bucket,),
+                )
+
+    def record_stat(self, metric: str, value: int = 1, dim: str = ""):
+        with self.lock:
+            cur = self.conn.cursor()
+            self._bump_stats(cur, [(metric, dim, value)])
+            self.conn.commit()
+
+    def record_upstream_error(self, model: Optional[str] = None):
+        self.record_stat("upstream_errors", 1, model or "")
+
+    def read_stats(self, table: str, since_bucket: str) -> Dict[str, Dict[str, int]]:
+        """{metric: {dim: total}} summed over buckets >= ``since_bucket``."""
+        if table not in ("stats_hourly", "stats_daily"):
+            raise ValueError(f"Unknown stats table: {table}")
+        cur = self.conn.cursor()
+        cur.execute(
+            f"SELECT metric, dim, SUM(value) FROM {table} WHERE bucket >= ? GROUP BY metric, dim",
+            (since_bucket,),
+        )
+        result: Dict[str, Dict[str, int]] = {}
+        for metric, dim, total in cur.fetchall():
+            result.setdefault(metric, {})[dim] = int(total or 0)
+        return result
+
+    def prune_stats_active(self, keep_days: int = 2):
+        """Drop per-user activity markers no longer needed to deduplicate active_users."""
+        with self.lock:
+            cutoff = (datetime.utcnow() - timedelta(days=keep_days)).strftime("%Y-%m-%d")
+            cur = self.conn.cursor()
+            cur.execute("DELETE FROM stats_active WHERE bucket < ?", (cutoff,))
+            self.conn.commit()
 
     def get_admins(self) -> List[int]:
         cur = self.conn.cursor()
@@ -162,14 +818,16 @@ class Database:
         return [int(r[0]) for r in rows]
 
     def add_admin(self, user_id: int):
-        cur = self.conn.cursor()
-        cur.execute("INSERT OR IGNORE INTO admins (user_id) VALUES (?)", (user_id,))
-        self.conn.commit()
+        with self.lock:
+            cur = self.conn.cursor()
+            cur.execute("INSERT OR IGNORE INTO admins (user_id) VALUES (?)", (user_id,))
+            self.conn.commit()
 
     def remove_admin(self, user_id: int):
-        cur = self.conn.cursor()
-        cur.execute("DELETE FROM admins WHERE user_id = ?", (user_id,))
-        self.conn.commit()
+        with self.lock:
+            cur = self.conn.cursor()
+            cur.execute("DELETE FROM admins WHERE user_id = ?", (user_id,))
+            self.conn.commit()
 
     def is_admin(self, user_id: int) -> bool:
         cur = self.conn.cursor()
@@ -0,0 +1,187 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Any, Optional
+import telebot
+from telebot import types
+from gateway import GATEWAY
+from router import CB_ADMIN, callback_prefix
+
+LANE_INTERACTIVE = "interactive"
+LANE_HEAVY = "heavy"
+LANE_ADMIN = "admin"
+
+
+class Lane:
+    """A named worker pool with its own queue and timing counters."""
+
+    def __init__(self, name: str, workers: int):
+        self.name = name
+        self.workers = max(1, int(workers))
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=f"lane-{name}")
+        self._lock = threading.Lock()
+        self.queued = 0
+        self.active = 0
+        self.processed = 0
+        self.failed = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.run_total = 0.0
+
+    def submit(self, fn: Callable, *args):
+        enqueued_at = time.monotonic()
+        with self._lock:
+            self.queued += 1
+        self.executor.submit(self._run, enqueued_at, fn, *args)
+
+    def _run(self, enqueued_at: float, fn: Callable, *args):
+        started = time.monotonic()
+        waited = started - enqueued_at
+        with self._lock:
+            self.queued -= 1
+            self.active += 1
+            self.wait_total += waited
+            self.wait_max = max(self.wait_max, waited)
+        ok = True
+        try:
+            fn(*args)
+        except Exception as e:
+            ok = False
+            logging.exception(f"Lane {self.name} handler error: {e}")
+        finally:
+            with self._lock:
+                self.active -= 1
+                self.processed += 1
+                if not ok:
+                    self.failed += 1
+                self.run_total += time.monotonic() - started
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            done = self.processed or 1
+            return {
+                "lane": self.name,
+                "workers": self.workers,
+                "queued": self.queued,
+                "active": self.active,
+                "processed": self.processed,
+                "failed": self.failed,
+                "avg_wait_ms": round(self.wait_total / done * 1000, 1),
+                "max_wait_ms": round(self.wait_max * 1000, 1),
+                "avg_run_ms": round(self.run_total / done * 1000, 1),
+            }
+
+
+class LanedTeleBot(telebot.TeleBot):
+    """
+    TeleBot that classifies every incoming update into a lane and runs its
+    handlers on that lane's pool, so slow TTS work cannot starve menus,
+    callbacks or the admin panel.
+    """
+
+    def __init__(self, token: str, lanes: Dict[str, int], **kwargs):
+        kwargs["threaded"] = False
+        super().__init__(token, **kwargs)
+        self.lanes: Dict[str, Lane] = {name: Lane(name, n) for name, n in lanes.items()}
+        self._lane_rules: List = []
+        # Called with update ids once their handlers have run (see polling.py)
+        self.on_updates_done: Optional[Callable[[List[int]], None]] = None
+
+    def add_lane_rule(self, predicate: Callable[[types.Update], bool], lane: str):
+        """Route updates matching ``predicate`` to ``lane``; rules are checked in registration order."""
+        if lane not in self.lanes:
+            raise ValueError(f"Unknown lane: {lane}")
+        self._lane_rules.append((predicate, lane))
+
+    def classify(self, update: types.Update) -> str:
+        for predicate, lane in self._lane_rules:
+            try:
+                if predicate(update):
+                    return lane
+            except Exception:
+                continue
+
+        if update.callback_query:
+            return LANE_ADMIN if callback_prefix(update.callback_query.data) == CB_ADMIN else LANE_INTERACTIVE
+
+        msg = update.message
+        if msg is not None:
+            text = msg.text or ""
+            if text.startswith("/admin"):
+                return LANE_ADMIN
+            if text.startswith("/") or msg.content_type != "text":
+                return LANE_INTERACTIVE
+            return LANE_HEAVY
+
+        return LANE_INTERACTIVE
+
+    def process_new_updates(self, updates: List[types.Update]):
+        for update in updates:
+            if update.update_id > self.last_update_id:
+                self.last_update_id = update.update_id
+            lane = self.lanes.get(self.classify(update)) or self.lanes[LANE_INTERACTIVE]
+            lane.submit(self.process_inline, update)
+
+    def process_inline(self, update: types.Update):
+        """Run ``update``'s handlers on the calling thread, bypassing the lanes."""
+        try:
+            super().process_new_updates([update])
+        finally:
+            if self.on_updates_done is not None:
+                self.on_updates_done([update.update_id])
+
+    def lane_stats(self) -> List[Dict[str, Any]]:
+        return [lane.stats() for lane in self.lanes.values()]
+
+    # Outbound calls all go through the paced gateway
+    def send_message(self, chat_id, text, *args, **kwargs):
+        return GATEWAY.call(super().send_message, chat_id, chat_id, text, *args, **kwargs)
+
+    def send_voice(self, chat_id, voice, *args, **kwargs):
+        return GATEWAY.call(super().send_voice, chat_id, chat_id, voice, *args, **kwargs)
+
+    def send_document(self, chat_id, document, *args, **kwargs):
+        return GATEWAY.call(super().send_document, chat_id, chat_id, document, *args, **kwargs)
+
+    def edit_message_text(self, text, chat_id=None, message_id=None, **kwargs):
+        return GATEWAY.call(super().edit_message_text, chat_id, text, chat_id=chat_id, message_id=message_id, **kwargs)
+
+    def edit_message_reply_markup(self, chat_id=None, message_id=None, reply_markup=None, **kwargs):
+        return GATEWAY.call(
+            super().edit_message_reply_markup, chat_id,
+            chat_id=chat_id, message_id=message_id, reply_markup=reply_markup, **kwargs
+        )
+
+    def delete_message(self, chat_id, message_id, *args, **kwargs):
+        return GATEWAY.call(super().delete_message, chat_id, chat_id, message_id, *args, **kwargs)
+
+    def answer_callback_query(self, callback_query_id, *args, **kwargs):
+        return GATEWAY.call(super().answer_callback_query, None, callback_query_id, *args, **kwargs)
+
+    def answer_inline_query(self, inline_query_id, *args, **kwargs):
+        return GATEWAY.call(super().answer_inline_query, None, inline_query_id, *args, **kwargs)
+
+    def upload_voice(self, chat_id, voice, **kwargs) -> types.Message:
+        """
+        Send ``voice`` to the bot's storage chat to get a file_id, then delete
+        the message. Paced globally only: the storage chat is not a user's, and
+        inline answers cannot wait behind its one-per-second slot.
+        """
+        msg = GATEWAY.call(super().send_voice, None, chat_id, voice, **kwargs)
+        try:
+            GATEWAY.call(super().delete_message, None, chat_id, msg.message_id)
+        except Exception:
+            pass
+        return msg
+
+
+def format_lane_stats(stats: List[Dict[str, Any]]) -> str:
+    lines = ["📊 Dispatch lanes"]
+    for s in stats:
+        lines.append(
+            f"• {s['lane']}: workers={s['workers']} queued={s['queued']} active={s['active']} "
+            f"done={s['processed']} failed={s['failed']} "
+            f"wait avg/max={s['avg_wait_ms']}/{s['max_wait_ms']}ms run avg={s['avg_run_ms']}ms"
+        )
+    return "\n".join(lines)
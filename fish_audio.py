@@ -7,8 +7,38 @@ from config import (
     USE_CONFIG_MODELS_ONLY,
     FISH_AUDIO_BACKEND,
     FISH_AUDIO_MP3_BITRATE,
+    FISH_AUDIO_MAX_CONNECTIONS,
 )
 from fish_audio_sdk import Session, TTSRequest
+from tracing import TransferTimer
+
+
+def build_tts_payload(
+    text: str,
+    voice_id: str,
+    format_: str,
+    speed: Optional[float] = None,
+    latency: str = "balanced",
+    mp3_bitrate: Optional[int] = None,
+) -> Dict:
+    """Request body for the REST ``/v1/tts`` endpoint."""
+    payload = {
+        "text": text,
+        "reference_id": voice_id,
+        "format": format_,
+        "model": FISH_AUDIO_BACKEND,
+        "normalize": True,
+        "latency": latency,      # ✅ fixed
+    }
+    if format_ == "opus":
+        payload["opus_bitrate"] = 48      # ✅ better quality
+    if format_ == "mp3" and isinstance(mp3_bitrate, int) and mp3_bitrate in (64, 128, 192):
+        payload["mp3_bitrate"] = mp3_bitrate
+
+    # Optional speed (include only if valid)
+    if isinstance(speed, (int, float)) and 0.5 <= float(speed) <= 1.3:
+        payload["speed"] = float(speed)
+    return payload
 
 
 class FishAudioClient:
@@ -64,24 +94,13 @@ class FishAudioClient:
         if format_ == "opus":
             try:
                 url = f"{self.base_url}/v1/tts"
-                payload = {
-                    "text": text,
-                    "reference_id": voice_id,
-                    "format": "opus",
-                    "model": FISH_AUDIO_BACKEND,
-                    "normalize": True,
-                    "latency": latency,      # ✅ fixed
-                    "opus_bitrate": 48,      # ✅ better quality
-                }
-
-                # Optional speed (include only if valid)
-                if isinstance(speed, (int, float)) and 0.5 <= float(speed) <= 1.3:
-                    payload["speed"] = float(speed)
+                payload = build_tts_payload(text, voice_id, "opus", speed=speed, latency=latency)
 
                 headers = self._headers()
                 headers["Content-Type"] = "application/json"
                 headers["Accept"] = "application/octet-stream"
 
+                timer = TransferTimer("fish")
                 r = requests.post(url, headers=headers, json=payload, stream=True, timeout=60)
                 if r.status_code != 200:
                     try:
@@ -93,7 +112,9 @@ class FishAudioClient:
                 audio_bytes = bytearray()
                 for chunk in r.iter_content(chunk_size=8192):
                     if chunk:
+                        timer.chunk()
                         audio_bytes.extend(chunk)
+                timer.done()
 
                 if not audio_bytes:
                     raise RuntimeError("TTS failed: empty audio")
@@ -119,7 +140,9 @@ class FishAudioClient:
 
             req = TTSRequest(**kwargs)
             audio_bytes = bytearray()
+            timer = TransferTimer("fish")
             for chunk in self.session.tts(req, backend=FISH_AUDIO_BACKEND):
+                timer.chunk()
                 if isinstance(chunk, (bytes, bytearray)):
                     audio_bytes.extend(chunk)
                 else:
@@ -127,6 +150,7 @@ class FishAudioClient:
                         audio_bytes.extend(bytes(chunk))
                     except Exception:
                         pass
+            timer.done()
 
             if not audio_bytes:
                 raise RuntimeError("TTS failed: empty audio")
@@ -134,3 +158,101 @@ class FishAudioClient:
 
         except Exception as e:
             raise RuntimeError(f"TTS failed: {e}")
+
+
+class AsyncFishAudioClient:
+    """
+    asyncio counterpart of FishAudioClient used by the async runtime.
+
+    All synthesis goes through the REST API on one pooled aiohttp session, so
+    many requests can be in flight without holding a thread each.
+    """
+
+    def __init__(self, api_key: Optional[str] = None, base_url: Optional[str] = None,
+                 max_connections: int = FISH_AUDIO_MAX_CONNECTIONS):
+        self.api_key = api_key or FISH_AUDIO_API_KEY
+        self.base_url = (base_url or FISH_AUDIO_BASE_URL).rstrip("/")
+        self.max_connections = max_connections
+        self._session = None
+
+    def _headers(self):
+        headers = {"Accept": "application/json"}
+        if self.api_key:
+            headers["Authorization"] = f"Bearer {self.api_key}"
+        return headers
+
+    async def _get_session(self):
+        # Lazy import: aiohttp is only needed in async mode
+        import aiohttp
+
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.max_connections),
+                timeout=aiohttp.ClientTimeout(total=60),
+            )
+        return self._session
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+
+    async def list_models(self) -> List[Dict]:
+        if USE_CONFIG_MODELS_ONLY:
+            return DEFAULT_MODELS
+        try:
+            session = await self._get_session()
+            async with session.get(f"{self.base_url}/voices", headers=self._headers(), timeout=15) as r:
+                if r.status == 200:
+                    data = await r.json()
+                    if isinstance(data, list):
+                        return data
+                    if isinstance(data, dict) and "voices" in data:
+                        return data["voices"]
+        except Exception:
+            pass
+        return DEFAULT_MODELS
+
+    async def synthesize_text(
+        self,
+        text: str,
+        voice_id: str,
+        language: str = "en",
+        format_: str = "opus",
+        mp3_bitrate: int = None,
+        speed: Optional[float] = None,
+        latency: str = "balanced",
+    ) -> bytes:
+        if latency not in ("low", "normal", "balanced"):
+            latency = "balanced"
+        if format_ == "mp3" and mp3_bitrate is None:
+            mp3_bitrate = FISH_AUDIO_MP3_BITRATE
+
+        try:
+            payload = build_tts_payload(text, voice_id, format_, speed=speed, latency=latency, mp3_bitrate=mp3_bitrate)
+            headers = self._headers()
+            headers["Content-Type"] = "application/json"
+            headers["Accept"] = "application/octet-stream"
+
+            session = await self._get_session()
+            timer = TransferTimer("fish")
+            async with session.post(f"{self.base_url}/v1/tts", headers=headers, json=payload) as r:
+                if r.status != 200:
+                    try:
+                        err = await r.json()
+                    except Exception:
+                        err = await r.text()
+                    raise RuntimeError(f"HTTP {r.status}: {err}")
+
+                audio_bytes = bytearray()
+                async for chunk in r.content.iter_chunked(8192):
+                    if chunk:
+                        timer.chunk()
+                        audio_bytes.extend(chunk)
+                timer.done()
+
+            if not audio_bytes:
+                raise RuntimeError("TTS failed: empty audio")
+            return bytes(audio_bytes)
+
+        except Exception as e:
+            raise RuntimeError(f"TTS failed (async HTTP): {e}")
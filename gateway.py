@@ -0,0 +1,185 @@
+import asyncio
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+from config import TG_PER_CHAT_INTERVAL, TG_GLOBAL_RATE, TG_MAX_RETRIES
+
+# Bot API methods that are safe to repeat after a network error or 5xx
+IDEMPOTENT_METHODS = {
+    "edit_message_text",
+    "edit_message_reply_markup",
+    "edit_message_caption",
+    "answer_callback_query",
+    "delete_message",
+}
+
+
+class OutboundPacer:
+    """
+    Hands out send slots: at most one message per ``per_chat_interval`` per
+    chat and ``global_rate`` messages per second overall. Slots are reserved
+    in arrival order, so a broadcast cannot starve individual replies.
+    """
+
+    def __init__(self, per_chat_interval: float, global_rate: float):
+        self.per_chat_interval = per_chat_interval
+        self.global_interval = 1.0 / global_rate if global_rate > 0 else 0.0
+        self._lock = threading.Lock()
+        self._chat_next: Dict[Any, float] = {}
+        self._global_next = 0.0
+        self.queued = 0
+        self.sent = 0
+        self.throttled = 0
+        self.retried = 0
+        self.failed = 0
+
+    def reserve(self, chat_id) -> float:
+        """Reserve the next slot for ``chat_id``; returns seconds to wait for it."""
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._global_next, self._chat_next.get(chat_id, 0.0))
+            self._global_next = slot + self.global_interval
+            if chat_id is not None:
+                self._chat_next[chat_id] = slot + self.per_chat_interval
+            if len(self._chat_next) > 10000:
+                self._chat_next = {k: v for k, v in self._chat_next.items() if v > now}
+            self.queued += 1
+            return slot - now
+
+    def release(self, sent: bool):
+        with self._lock:
+            self.queued -= 1
+            if sent:
+                self.sent += 1
+
+    def count(self, retried: bool):
+        with self._lock:
+            if retried:
+                self.retried += 1
+            else:
+                self.failed += 1
+
+    def back_off(self, chat_id, retry_after: float):
+        """Honour a 429: push the chat (or everything, without a chat) past ``retry_after``."""
+        with self._lock:
+            until = time.monotonic() + retry_after
+            self.throttled += 1
+            if chat_id is None:
+                self._global_next = max(self._global_next, until)
+            else:
+                self._chat_next[chat_id] = max(self._chat_next.get(chat_id, 0.0), until)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "queued": self.queued,
+                "sent": self.sent,
+                "throttled": self.throttled,
+                "retried": self.retried,
+                "failed": self.failed,
+            }
+
+
+def _retry_after(e: Exception) -> Optional[float]:
+    if getattr(e, "error_code", None) != 429:
+        return None
+    params = (getattr(e, "result_json", None) or {}).get("parameters") or {}
+    return float(params.get("retry_after") or 1)
+
+
+def _is_transient(e: Exception) -> bool:
+    code = getattr(e, "error_code", None)
+    if isinstance(code, int):
+        return code >= 500
+    # Network-level failures (requests / aiohttp) carry no Telegram error code
+    return isinstance(e, (ConnectionError, TimeoutError, OSError)) or type(e).__module__.startswith(("requests", "aiohttp"))
+
+
+def _rewind(args, kwargs):
+    for a in list(args) + list(kwargs.values()):
+        if hasattr(a, "seek"):
+            try:
+                a.seek(0)
+            except Exception:
+                pass
+
+
+class TelegramGateway:
+    """
+    Single exit point for Bot API calls: paces per chat and globally, waits
+    out 429 ``retry_after``, retries idempotent calls on transient errors and
+    logs what finally fails. ``call`` is for TeleBot, ``acall`` for AsyncTeleBot;
+    both share one pacer so the two runtimes respect the same limits.
+    ``chat_id`` is only the pacing key; ``fn`` gets ``*args, **kwargs`` as is.
+    """
+
+    def __init__(self, pacer: OutboundPacer, max_retries: int = TG_MAX_RETRIES):
+        self.pacer = pacer
+        self.max_retries = max_retries
+
+    def _should_retry(self, e: Exception, chat_id, idempotent: bool, attempt: int) -> Optional[float]:
+        """Seconds to back off before retrying, or None to give up."""
+        if attempt >= self.max_retries:
+            return None
+        retry_after = _retry_after(e)
+        if retry_after is not None:
+            # A 429 means the request was not processed, so any method may be repeated
+            self.pacer.back_off(chat_id, retry_after)
+            return 0.0
+        if idempotent and _is_transient(e):
+            return 0.5 * (2 ** attempt)
+        return None
+
+    def call(self, fn: Callable, chat_id, /, *args, **kwargs):
+        idempotent = fn.__name__ in IDEMPOTENT_METHODS
+        attempt = 0
+        while True:
+            time.sleep(self.pacer.reserve(chat_id))
+            try:
+                result = fn(*args, **kwargs)
+                self.pacer.release(True)
+                return result
+            except Exception as e:
+                self.pacer.release(False)
+                delay = self._should_retry(e, chat_id, idempotent, attempt)
+                if delay is None:
+                    self.pacer.count(retried=False)
+                    logging.warning(f"Telegram {fn.__name__} to {chat_id} failed: {e}")
+                    raise
+                self.pacer.count(retried=True)
+                attempt += 1
+                time.sleep(delay)
+                _rewind(args, kwargs)
+
+    async def acall(self, fn: Callable, chat_id, /, *args, **kwargs):
+        idempotent = fn.__name__ in IDEMPOTENT_METHODS
+        attempt = 0
+        while True:
+            await asyncio.sleep(self.pacer.reserve(chat_id))
+            try:
+                result = await fn(*args, **kwargs)
+                self.pacer.release(True)
+                return result
+            except Exception as e:
+                self.pacer.release(False)
+                delay = self._should_retry(e, chat_id, idempotent, attempt)
+                if delay is None:
+                    self.pacer.count(retried=False)
+                    logging.warning(f"Telegram {fn.__name__} to {chat_id} failed: {e}")
+                    raise
+                self.pacer.count(retried=True)
+                attempt += 1
+                await asyncio.sleep(delay)
+                _rewind(args, kwargs)
+
+
+PACER = OutboundPacer(TG_PER_CHAT_INTERVAL, TG_GLOBAL_RATE)
+GATEWAY = TelegramGateway(PACER)
+
+
+def format_gateway_stats(stats: Dict[str, Any]) -> str:
+    return (
+        f"📤 Outbound: queued={stats['queued']} sent={stats['sent']} "
+        f"429s={stats['throttled']} retried={stats['retried']} failed={stats['failed']}"
+    )
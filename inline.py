@@ -0,0 +1,197 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional, Tuple
+from telebot import types
+from config import (
+    ADMIN_IDS,
+    COST_PER_VOICE,
+    REQUIRE_VALIDITY_FOR_TTS,
+    INLINE_DEBOUNCE_MS,
+    INLINE_WORKERS,
+    INLINE_CACHE_TIME,
+    INLINE_UPLOAD_CHAT_ID,
+)
+from dispatch import LanedTeleBot
+from fish_audio import FishAudioClient
+from tracing import trace, span
+from voice_store import read_stored, store_voice_copy
+from user_panel import (
+    humanize_text,
+    phrase_key,
+    speed_to_value,
+    speed_to_label,
+    get_model_name,
+    tts_precheck,
+)
+
+# Result ids: "i<inline_voices.id>" for voices synthesized for inline mode,
+# "p<phrase_audio.id>" for the pre-synthesized phrase library
+RESULT_INLINE = "i"
+RESULT_PHRASE = "p"
+
+
+def is_inline_update(update: types.Update) -> bool:
+    return update.inline_query is not None or update.chosen_inline_result is not None
+
+
+class Debouncer:
+    """
+    Holds the latest item per key for ``delay_ms`` before handing it to
+    ``handle`` on a small worker pool. A newer item for the same key
+    replaces the pending one, so while a user is still typing nothing is
+    synthesized. One timer thread; no worker sleeps while waiting.
+    """
+
+    def __init__(self, delay_ms: int, handle: Callable[[Any], None], workers: int):
+        self.delay = delay_ms / 1000.0
+        self.handle = handle
+        self.pool = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="inline")
+        self._pending: Dict[Any, Tuple[float, Any]] = {}
+        self._cond = threading.Condition()
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def submit(self, key, item):
+        with self._cond:
+            self._pending[key] = (time.monotonic() + self.delay, item)
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                now = time.monotonic()
+                due = [k for k, (at, _) in self._pending.items() if at <= now]
+                if not due:
+                    self._cond.wait(min(at for at, _ in self._pending.values()) - now)
+                    continue
+                items = [self._pending.pop(k)[1] for k in due]
+            for item in items:
+                self.pool.submit(self._handle, item)
+
+    def _handle(self, item):
+        try:
+            self.handle(item)
+        except Exception as e:
+            logging.exception(f"Inline handler error: {e}")
+
+
+def register_inline_handlers(bot: LanedTeleBot, db, store):
+    """
+    Inline mode: ``@bot <text>`` in any chat offers the text as a voice in
+    the user's selected model and speed. Voices already uploaded to Telegram
+    (inline cache or phrase library) are offered at once; anything else is
+    synthesized once the user stops typing. Credits are charged when a
+    result is actually sent (chosen_inline_result).
+    """
+    client = FishAudioClient()
+    if INLINE_UPLOAD_CHAT_ID in ADMIN_IDS:
+        logging.warning(
+            "INLINE_UPLOAD_CHAT_ID is an admin's chat; uploads fail until that admin has started "
+            "the bot. Set it to a private channel the bot administers."
+        )
+
+    def answer_hint(query: types.InlineQuery, text: str):
+        button = types.InlineQueryResultsButton(text, start_parameter="inline")
+        bot.answer_inline_query(query.id, [], cache_time=0, is_personal=True, button=button)
+
+    def answer_voice(query: types.InlineQuery, result_id: str, file_id: str, model: str, mode: str):
+        title = f"🎙️ {get_model_name(client.list_models(), model)} · {speed_to_label(mode)}"
+        result = types.InlineQueryResultCachedVoice(result_id, file_id, title)
+        bot.answer_inline_query(query.id, [result], cache_time=INLINE_CACHE_TIME, is_personal=True)
+
+    def cached_result(key: str, model: str, mode: str) -> Optional[Tuple[str, str]]:
+        hit = db.get_inline_voice(key, model, mode)
+        if hit and hit["file_id"]:
+            return f"{RESULT_INLINE}{hit['id']}", hit["file_id"]
+        phrase = db.get_phrase_audio(key, model, mode)
+        if phrase and phrase["file_id"]:
+            return f"{RESULT_PHRASE}{phrase['id']}", phrase["file_id"]
+        return None
+
+    def upload(audio: bytes) -> str:
+        """Send the voice once to get a file_id inline results can reference."""
+        msg = bot.upload_voice(INLINE_UPLOAD_CHAT_ID, audio, disable_notification=True)
+        return msg.voice.file_id
+
+    def synthesize_and_answer(item):
+        query, key, text, model, mode = item
+        with trace("inline", user_id=query.from_user.id, chars=len(text)):
+            phrase = db.get_phrase_audio(key, model, mode)
+            if phrase:
+                # Pre-synthesized but never sent yet: upload the stored audio
+                with span("upload"):
+                    file_id = upload(read_stored(store, lambda: db.get_phrase_audio_by_id(phrase["id"]) or phrase))
+                db.set_phrase_file_id(phrase["id"], file_id)
+                return answer_voice(query, f"{RESULT_PHRASE}{phrase['id']}", file_id, model, mode)
+
+            try:
+                audio_bytes = client.synthesize_text(
+                    humanize_text(text),
+                    model,
+                    language="en",
+                    format_="opus",
+                    speed=speed_to_value(mode),
+                    latency="balanced",
+                )
+            except Exception as e:
+                db.record_upstream_error(model)
+                logging.warning(f"Inline synthesis failed: {e}")
+                return answer_hint(query, "TTS error, please try again")
+
+            with span("store_write"):
+                segment, offset, length = store.append(audio_bytes)
+            with span("upload"):
+                file_id = upload(audio_bytes)
+            inline_voice_id = db.store_inline_voice(key, model, mode, file_id, segment, offset, length)
+            answer_voice(query, f"{RESULT_INLINE}{inline_voice_id}", file_id, model, mode)
+
+    debouncer = Debouncer(INLINE_DEBOUNCE_MS, synthesize_and_answer, INLINE_WORKERS)
+
+    @bot.inline_handler(func=lambda q: True)
+    def inline_query(query: types.InlineQuery):
+        text = (query.query or "").strip()
+        if not text:
+            return answer_hint(query, "Type the text to voice")
+
+        user = db.get_user(query.from_user.id)
+        if not user:
+            return answer_hint(query, "Open the bot and press Start first")
+        valid = db.is_valid(query.from_user.id) if REQUIRE_VALIDITY_FOR_TTS else True
+        error = tts_precheck(text, user, valid)
+        if error:
+            return answer_hint(query, error)
+
+        model = user.get("selected_model")
+        mode = (user.get("tts_speed") or "natural").strip().lower()
+        key = phrase_key(text)
+        hit = cached_result(key, model, mode)
+        if hit:
+            return answer_voice(query, *hit, model, mode)
+        # Uncached: only the query the user stops typing at gets synthesized
+        debouncer.submit(query.from_user.id, (query, key, text, model, mode))
+
+    @bot.chosen_inline_handler(func=lambda r: True)
+    def inline_chosen(result: types.ChosenInlineResult):
+        kind, ref = result.result_id[:1], result.result_id[1:]
+        if not ref.isdigit():
+            return
+        if kind == RESULT_INLINE:
+            fetch = lambda: db.get_inline_voice_by_id(int(ref))
+        elif kind == RESULT_PHRASE:
+            fetch = lambda: db.get_phrase_audio_by_id(int(ref))
+        else:
+            return
+
+        uid = result.from_user.id
+        # The location is read under the store's pin, so compaction cannot move it in between
+        if store_voice_copy(store, db, uid, fetch, len(result.query or "")) is None:
+            return
+        if kind == RESULT_INLINE:
+            db.touch_inline_voice(int(ref))
+        else:
+            db.record_stat("phrase_hits")
+        db.remove_credits(uid, COST_PER_VOICE, consumed=True)
+        db.record_stat("inline_voices")
@@ -1,20 +1,36 @@
+import asyncio
 import logging
 import os
 import threading
 import time
 import telebot
 from telebot.types import BotCommand
-from config import TELEGRAM_BOT_TOKEN, DB_PATH, VOICES_DIR, ADMIN_IDS, USE_WEBHOOK, WEBHOOK_BASE_URL, PORT
+from config import (
+    TELEGRAM_BOT_TOKEN, DB_PATH, VOICES_DIR, ADMIN_IDS, USE_WEBHOOK, WEBHOOK_BASE_URL, PORT,
+    LANE_INTERACTIVE_WORKERS, LANE_HEAVY_WORKERS, LANE_ADMIN_WORKERS, STATE_BACKEND, STATE_DB_PATH,
+    ASYNC_MODE, VOICE_SEGMENT_MAX_BYTES, VOICE_COMPACT_INTERVAL,
+    MAINTENANCE_INTERVAL,
+)
 from db import Database
+from state_store import create_state_store
+from voice_store import VoiceStore
+from dispatch import LanedTeleBot, LANE_INTERACTIVE, LANE_HEAVY, LANE_ADMIN
+from router import Router
+from polling import run_polling
 from admin_panel import register_admin_handlers
 from user_panel import register_user_handlers
-from scheduler import start_expiry_cleanup_thread
+from batch import register_batch_handlers
+from inline import register_inline_handlers
+from tracing import TraceIdFilter
+from scheduler import start_expiry_cleanup_thread, start_compaction_thread, start_maintenance_thread
+from phrases import start_phrase_thread
 
 
 def set_commands(bot: telebot.TeleBot):
     commands = [
         BotCommand("start", "Start"),
         BotCommand("admin", "Admin panel"),
+        BotCommand("slow", "Slowest recent requests (admin)"),
     ]
     try:
         bot.set_my_commands(commands)
@@ -23,7 +39,9 @@ def set_commands(bot: telebot.TeleBot):
 
 
 def main():
-    logging.basicConfig(level=logging.INFO)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s [%(trace_id)s] %(name)s: %(message)s")
+    for handler in logging.getLogger().handlers:
+        handler.addFilter(TraceIdFilter())
     try:
         telebot.logger.setLevel(logging.DEBUG)
     except Exception:
@@ -34,11 +52,39 @@ def main():
     db = Database(DB_PATH)
     for aid in ADMIN_IDS:
         db.add_admin(aid)
-    bot = telebot.TeleBot(TELEGRAM_BOT_TOKEN, parse_mode="HTML")
-    register_admin_handlers(bot, db)
-    register_user_handlers(bot, db)
+    state = create_state_store(STATE_BACKEND, STATE_DB_PATH)
+    store = VoiceStore(VOICES_DIR, VOICE_SEGMENT_MAX_BYTES)
+    bot = LanedTeleBot(
+        TELEGRAM_BOT_TOKEN,
+        lanes={
+            LANE_INTERACTIVE: LANE_INTERACTIVE_WORKERS,
+            LANE_HEAVY: LANE_HEAVY_WORKERS,
+            LANE_ADMIN: LANE_ADMIN_WORKERS,
+        },
+        parse_mode="HTML",
+    )
+    router = Router()
+    register_admin_handlers(bot, db, state, router)
+    batch_runner = register_batch_handlers(bot, db, store, state)
+    register_inline_handlers(bot, db, store)
     set_commands(bot)
-    start_expiry_cleanup_thread(db, bot)
+    start_expiry_cleanup_thread(db, bot, state=state)
+    start_compaction_thread(db, store, VOICE_COMPACT_INTERVAL, state=state)
+    start_maintenance_thread(db, store, bot, MAINTENANCE_INTERVAL, state=state)
+    start_phrase_thread(db, store, state=state)
+    batch_runner.start_resume_thread()
+
+    if ASYNC_MODE:
+        # Lazy import: the asyncio stack (aiohttp) is only needed here.
+        # User flows run on AsyncTeleBot; admin updates still go to the threaded bot.
+        from async_runtime import run_async
+        router.install(bot)
+        asyncio.run(run_async(bot, db, store))
+        return
+
+    register_user_handlers(bot, db, store, router)
+    # Installed last: command handlers registered above are matched first
+    router.install(bot)
     # Decide between webhook mode (Railway) and local polling
     if USE_WEBHOOK and WEBHOOK_BASE_URL:
         # Lazy import Flask only when needed
@@ -60,7 +106,7 @@ def main():
                         pass
             except Exception:
                 print("Bot started, polling...")
-            bot.infinity_polling(skip_pending=True, allowed_updates=['message','callback_query'])
+            run_polling(bot, db)
             return
 
         app = Flask(__name__)
@@ -130,7 +176,7 @@ def main():
                     pass
         except Exception:
             print("Bot started, polling...")
-        bot.infinity_polling(skip_pending=True, allowed_updates=['message','callback_query'])
+        run_polling(bot, db)
 
 
 if __name__ == "__main__":
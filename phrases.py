@@ -0,0 +1,89 @@
+import logging
+import threading
+import time
+from datetime import datetime
+from config import (
+    DEFAULT_MODELS,
+    PHRASE_PROMOTE_MIN_HITS,
+    PHRASE_PROMOTE_LIMIT,
+    PHRASE_SYNTH_PER_MINUTE,
+    PHRASE_INTERVAL,
+)
+from fish_audio import FishAudioClient
+from scheduler import in_quiet_hours, _holds_lease
+from state_store import make_owner_id
+from user_panel import humanize_text, speed_to_value, SPEED_MODES
+
+PHRASE_LEASE = "phrase_presynthesis"
+
+
+def promote_frequent_texts(db) -> int:
+    """Add the most requested texts that are not in the library yet."""
+    added = 0
+    for row in db.top_unpromoted_texts(PHRASE_PROMOTE_MIN_HITS, PHRASE_PROMOTE_LIMIT):
+        if db.add_phrase(row["text_key"], row["text"], "auto"):
+            added += 1
+    return added
+
+
+def presynthesize_phrases(db, store, client: FishAudioClient, should_stop) -> int:
+    """
+    Synthesize every missing (phrase, model, speed) combination, at most
+    PHRASE_SYNTH_PER_MINUTE per minute, until done or ``should_stop()``.
+    Uses the same text preparation and parameters as tts_entry so cached
+    audio matches what a live request would produce.
+    """
+    pause = 60.0 / max(1, PHRASE_SYNTH_PER_MINUTE)
+    made = 0
+    for phrase in db.list_phrases():
+        for model in DEFAULT_MODELS:
+            for mode in SPEED_MODES:
+                if should_stop():
+                    return made
+                if db.has_phrase_audio(phrase["id"], model["id"], mode):
+                    continue
+                try:
+                    audio_bytes = client.synthesize_text(
+                        humanize_text(phrase["text"]),
+                        model["id"],
+                        language="en",
+                        format_="opus",
+                        speed=speed_to_value(mode),
+                        latency="slow",
+                    )
+                except Exception as e:
+                    logging.warning(f"Phrase #{phrase['id']} ({model['id']}/{mode}) synthesis failed: {e}")
+                    db.record_upstream_error(model["id"])
+                    time.sleep(pause)
+                    continue
+                segment, offset, length = store.append(audio_bytes)
+                db.store_phrase_audio(phrase["id"], model["id"], mode, segment, offset, length)
+                made += 1
+                time.sleep(pause)
+    return made
+
+
+def _phrase_worker(db, store, interval_seconds: int, state, owner: str):
+    client = FishAudioClient()
+
+    def should_stop() -> bool:
+        # Renewing the lease here keeps a long run owned by this process
+        return not in_quiet_hours(datetime.utcnow()) or not _holds_lease(state, PHRASE_LEASE, owner, interval_seconds * 2)
+
+    while True:
+        time.sleep(interval_seconds)
+        if should_stop():
+            continue
+        try:
+            promoted = promote_frequent_texts(db)
+            made = presynthesize_phrases(db, store, client, should_stop)
+            if promoted or made:
+                logging.info(f"Phrase library: {promoted} texts promoted, {made} voices pre-synthesized")
+        except Exception as e:
+            logging.exception(f"Phrase pre-synthesis failed: {e}")
+
+
+def start_phrase_thread(db, store, interval_seconds: int = PHRASE_INTERVAL, state=None):
+    owner = make_owner_id()
+    t = threading.Thread(target=_phrase_worker, args=(db, store, interval_seconds, state, owner), daemon=True)
+    t.start()
@@ -0,0 +1,138 @@
+import logging
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Tuple
+from telebot import apihelper, types
+from config import POLL_BATCH_SIZE, POLL_TIMEOUT, POLL_BACKLOG_CONCURRENCY
+
+ALLOWED_UPDATES = ["message", "callback_query", "inline_query", "chosen_inline_result"]
+
+
+def chat_key(update: types.Update):
+    """Updates with the same key are handled in order; different keys may run in parallel."""
+    if update.message is not None:
+        return update.message.chat.id
+    if update.callback_query is not None:
+        return update.callback_query.from_user.id
+    return ("update", update.update_id)
+
+
+def collapse_duplicate_callbacks(updates: List[types.Update]) -> Tuple[List[types.Update], List[types.Update]]:
+    """
+    Keep only the last press of the same button by the same user; a backlog
+    often holds several presses made while the bot was down. Returns
+    (updates to handle, dropped duplicates).
+    """
+    last: Dict[tuple, int] = {}
+    for u in updates:
+        c = u.callback_query
+        if c is not None:
+            where = c.message.message_id if c.message is not None else c.inline_message_id
+            last[(c.from_user.id, where, c.data)] = u.update_id
+
+    keep, dropped = [], []
+    for u in updates:
+        c = u.callback_query
+        if c is not None:
+            where = c.message.message_id if c.message is not None else c.inline_message_id
+            if last[(c.from_user.id, where, c.data)] != u.update_id:
+                dropped.append(u)
+                continue
+        keep.append(u)
+    return keep, dropped
+
+
+def group_by_chat(updates: List[types.Update]) -> List[List[types.Update]]:
+    groups: Dict = OrderedDict()
+    for u in updates:
+        groups.setdefault(chat_key(u), []).append(u)
+    return list(groups.values())
+
+
+def prepare_backlog(bot, db, raw_updates) -> List[List[types.Update]]:
+    """
+    Journaled plus freshly fetched updates, deduplicated and grouped per chat.
+    Dropped duplicate presses are answered so their buttons stop spinning.
+    """
+    backlog = [types.Update.de_json(u) for u in raw_updates]
+    keep, dropped = collapse_duplicate_callbacks(backlog)
+    if dropped:
+        for u in dropped:
+            try:
+                bot.answer_callback_query(u.callback_query.id)
+            except Exception:
+                # Queries older than a few minutes can no longer be answered
+                pass
+        db.finish_updates([u.update_id for u in dropped])
+        logging.info(f"Backlog: dropped {len(dropped)} duplicate button presses")
+    return group_by_chat(keep)
+
+
+def fetch_backlog(bot, db) -> None:
+    """Journal everything Telegram has queued for us, without waiting for new updates."""
+    while True:
+        raw = apihelper.get_updates(
+            bot.token, db.get_update_offset() + 1, POLL_BATCH_SIZE,
+            allowed_updates=ALLOWED_UPDATES, long_polling_timeout=1,
+        )
+        if not raw:
+            return
+        db.journal_updates(raw)
+
+
+def drain_backlog(bot, db) -> int:
+    """
+    Handle updates left over from the previous run and those queued while
+    the bot was down: one chat at a time, POLL_BACKLOG_CONCURRENCY chats in
+    parallel. Returns the number of updates handled.
+    """
+    try:
+        fetch_backlog(bot, db)
+    except Exception as e:
+        logging.warning(f"Could not fetch queued updates: {e}")
+    groups = prepare_backlog(bot, db, db.list_pending_updates())
+    if not groups:
+        return 0
+
+    def run_group(group):
+        for update in group:
+            try:
+                bot.process_inline(update)
+            except Exception as e:
+                logging.exception(f"Backlog update {update.update_id} failed: {e}")
+
+    total = sum(len(g) for g in groups)
+    logging.info(f"Draining backlog: {total} updates from {len(groups)} chats")
+    with ThreadPoolExecutor(max_workers=POLL_BACKLOG_CONCURRENCY, thread_name_prefix="backlog") as pool:
+        list(pool.map(run_group, groups))
+    return total
+
+
+def run_polling(bot, db):
+    """
+    Long polling that resumes from the offset stored in the database instead
+    of skipping pending updates. Every fetched update is journaled before it
+    is handed to the lanes and removed once handled, so a restart neither
+    loses nor re-fetches work.
+    """
+    bot.on_updates_done = db.finish_updates
+    drain_backlog(bot, db)
+
+    errors = 0
+    while True:
+        try:
+            raw = apihelper.get_updates(
+                bot.token, db.get_update_offset() + 1, POLL_BATCH_SIZE,
+                allowed_updates=ALLOWED_UPDATES, long_polling_timeout=POLL_TIMEOUT,
+            )
+            errors = 0
+        except Exception as e:
+            errors += 1
+            delay = min(30, 2 ** errors)
+            logging.warning(f"getUpdates failed ({e}); retrying in {delay}s")
+            time.sleep(delay)
+            continue
+        if raw:
+            db.journal_updates(raw)
+            bot.process_new_updates([types.Update.de_json(u) for u in raw])
@@ -0,0 +1,115 @@
+import asyncio
+import inspect
+from typing import Callable, Dict, List, Optional, Tuple
+from telebot import types
+
+# Callback data is "<version><prefix>:<arg>:<arg>...", e.g. "1a:credits:add:42".
+# Bump CALLBACK_VERSION when the layout changes; older buttons keep working
+# through LEGACY_PREFIXES until they scroll out of users' chats.
+CALLBACK_VERSION = "1"
+CB_ADMIN = "a"
+CB_MODEL = "m"
+CB_SPEED = "s"
+LEGACY_PREFIXES = {"admin": CB_ADMIN, "model": CB_MODEL, "speed": CB_SPEED}
+
+
+def cb_data(prefix: str, *args) -> str:
+    """Build callback data for ``prefix``; Telegram allows at most 64 bytes."""
+    data = f"{CALLBACK_VERSION}{prefix}:" + ":".join(str(a) for a in args)
+    if len(data.encode()) > 64:
+        raise ValueError(f"Callback data too long: {data}")
+    return data
+
+
+def parse_callback(data: Optional[str]) -> Tuple[Optional[str], List[str]]:
+    """Split callback data into (prefix, args); prefix is None if it is not ours."""
+    head, _, rest = (data or "").partition(":")
+    args = rest.split(":") if rest else []
+    if head[:1] == CALLBACK_VERSION:
+        return head[1:], args
+    return LEGACY_PREFIXES.get(head), args
+
+
+def callback_prefix(data: Optional[str]) -> Optional[str]:
+    return parse_callback(data)[0]
+
+
+class Router:
+    """
+    Single entry point for text messages and callback queries. Menu texts
+    and callback prefixes are dict lookups, so the cost per update does not
+    grow with the number of routes. Intercepts (e.g. a pending admin step)
+    are checked first, and unmatched text goes to the fallback handler.
+
+    Call ``install`` once, after the command handlers are registered.
+    """
+
+    def __init__(self):
+        self.menu: Dict[str, Callable] = {}
+        self.callbacks: Dict[str, Callable] = {}
+        self.intercepts: List[Tuple[Callable, Callable]] = []
+        self.fallback: Optional[Callable] = None
+
+    def on_text(self, *texts: str):
+        def decorator(fn):
+            for text in texts:
+                self.menu[text] = fn
+            return fn
+        return decorator
+
+    def on_callback(self, prefix: str):
+        """Register ``fn(callback, args)`` for callback data with ``prefix``."""
+        def decorator(fn):
+            self.callbacks[prefix] = fn
+            return fn
+        return decorator
+
+    def intercept(self, predicate: Callable[[types.Message], bool]):
+        def decorator(fn):
+            self.intercepts.append((predicate, fn))
+            return fn
+        return decorator
+
+    def on_other_text(self, fn):
+        self.fallback = fn
+        return fn
+
+    def is_menu(self, text: Optional[str]) -> bool:
+        return text in self.menu
+
+    def route_message(self, message: types.Message) -> Optional[Callable]:
+        for predicate, fn in self.intercepts:
+            if predicate(message):
+                return fn
+        return self.menu.get(message.text) or self.fallback
+
+    def route_callback(self, callback: types.CallbackQuery) -> Tuple[Optional[Callable], List[str]]:
+        prefix, args = parse_callback(callback.data)
+        return self.callbacks.get(prefix), args
+
+    def handle_message(self, message: types.Message):
+        fn = self.route_message(message)
+        return fn(message) if fn else None
+
+    def handle_callback(self, callback: types.CallbackQuery):
+        fn, args = self.route_callback(callback)
+        return fn(callback, args) if fn else None
+
+    def install(self, bot):
+        """Register the router's two handlers on a TeleBot or AsyncTeleBot."""
+        if asyncio.iscoroutinefunction(bot.process_new_updates):
+            async def on_message(message):
+                result = self.handle_message(message)
+                if inspect.isawaitable(result):
+                    await result
+
+            async def on_callback(callback):
+                result = self.handle_callback(callback)
+                if inspect.isawaitable(result):
+                    await result
+        else:
+            on_message = self.handle_message
+            on_callback = self.handle_callback
+
+        bot.message_handler(content_types=["text"])(on_message)
+        bot.callback_query_handler(func=lambda c: True)(on_callback)
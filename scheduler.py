@@ -1,12 +1,44 @@
+import logging
 import os
 import time
 import threading
-from datetime import datetime
-from config import VOICES_DIR
+from datetime import datetime, timedelta
+from config import (
+    ADMIN_IDS,
+    VOICE_COMPACT_MIN_DEAD_RATIO,
+    VOICE_COMPACT_GRACE_SECONDS,
+    RETENTION_POLICIES,
+    MAINTENANCE_QUIET_HOURS,
+    MAINTENANCE_BATCH_SIZE,
+    MAINTENANCE_VACUUM_PAGES,
+    INLINE_CACHE_KEEP_DAYS,
+    TEXT_COUNTS_KEEP_DAYS,
+    TEXT_COUNTS_MAX_ROWS,
+)
+from state_store import make_owner_id
+from voice_store import compact_voice_store
 
+EXPIRY_LEASE = "expiry_cleanup"
+COMPACTION_LEASE = "voice_compaction"
+MAINTENANCE_LEASE = "maintenance"
 
-def _expiry_cleanup_worker(db, bot, interval_seconds: int):
+
+def _holds_lease(state, name: str, owner: str, ttl_seconds: int) -> bool:
+    if state is None:
+        return True
+    try:
+        return state.acquire_lease(name, owner, ttl_seconds)
+    except Exception:
+        return False
+
+
+def _expiry_cleanup_worker(db, bot, interval_seconds: int, state=None, owner: str = ""):
     while True:
+        # Only one process may run the sweep; the lease outlives one interval so
+        # the holder keeps it while alive and another process takes over if it dies.
+        if not _holds_lease(state, EXPIRY_LEASE, owner, interval_seconds * 2):
+            time.sleep(interval_seconds)
+            continue
         try:
             users = db.list_users(limit=10000)
             now = datetime.utcnow()
@@ -18,7 +50,10 @@ def _expiry_cleanup_worker(db, bot, interval_seconds: int):
                     if datetime.fromisoformat(exp) <= now:
                         user_id = int(u["id"])
                         voices = db.list_user_voices(user_id)
+                        # Pack-stored voices are reclaimed by compaction; only legacy files are removed here
                         for v in voices:
+                            if not v.get("file_path"):
+                                continue
                             try:
                                 if os.path.exists(v["file_path"]):
                                     os.remove(v["file_path"])
@@ -37,6 +72,165 @@ def _expiry_cleanup_worker(db, bot, interval_seconds: int):
         time.sleep(interval_seconds)
 
 
-def start_expiry_cleanup_thread(db, bot, interval_seconds: int = 3600):
-    t = threading.Thread(target=_expiry_cleanup_worker, args=(db, bot, interval_seconds), daemon=True)
-    t.start()
\ No newline at end of file
+def start_expiry_cleanup_thread(db, bot, interval_seconds: int = 3600, state=None):
+    owner = make_owner_id()
+    t = threading.Thread(target=_expiry_cleanup_worker, args=(db, bot, interval_seconds, state, owner), daemon=True)
+    t.start()
+
+
+def _compact(db, store, state, owner: str, ttl_seconds: int):
+    """
+    Compact under COMPACTION_LEASE, so the periodic worker and the nightly
+    maintenance never rewrite the same segment at once. The lease is released
+    afterwards; returns None if another run holds it.
+    """
+    if not _holds_lease(state, COMPACTION_LEASE, owner, ttl_seconds):
+        return None
+    try:
+        return compact_voice_store(store, db, VOICE_COMPACT_MIN_DEAD_RATIO, VOICE_COMPACT_GRACE_SECONDS)
+    finally:
+        if state is not None:
+            try:
+                state.release_lease(COMPACTION_LEASE, owner)
+            except Exception:
+                pass
+
+
+def _compaction_worker(db, store, interval_seconds: int, state=None, owner: str = ""):
+    while True:
+        time.sleep(interval_seconds)
+        try:
+            result = _compact(db, store, state, owner, interval_seconds * 2)
+            if result and result["segments"]:
+                logging.info(
+                    f"Voice compaction: {result['segments']} segments rewritten, "
+                    f"{result['moved']} voices moved, {result['reclaimed_bytes']} bytes reclaimed"
+                )
+        except Exception as e:
+            logging.exception(f"Voice compaction failed: {e}")
+
+
+def start_compaction_thread(db, store, interval_seconds: int = 6 * 3600, state=None):
+    owner = make_owner_id()
+    t = threading.Thread(target=_compaction_worker, args=(db, store, interval_seconds, state, owner), daemon=True)
+    t.start()
+
+
+def in_quiet_hours(now: datetime, window: str = MAINTENANCE_QUIET_HOURS) -> bool:
+    """``window`` is "start-end" in UTC hours; it may wrap midnight (e.g. "22-4")."""
+    try:
+        start, end = (int(x) for x in window.split("-", 1))
+    except Exception:
+        return False
+    if start <= end:
+        return start <= now.hour < end
+    return now.hour >= start or now.hour < end
+
+
+def _voices_over_policy(voices, policy, now: datetime):
+    max_voices = policy.get("max_voices")
+    max_age_days = policy.get("max_age_days")
+    max_bytes = policy.get("max_bytes")
+    cutoff = now - timedelta(days=max_age_days) if max_age_days else None
+
+    doomed = []
+    kept = 0
+    kept_bytes = 0
+    for v in voices:  # newest first, so the oldest voices go first
+        size = int(v.get("length") or 0)
+        too_old = False
+        if cutoff is not None:
+            try:
+                too_old = datetime.fromisoformat(v["created_at"]) < cutoff
+            except Exception:
+                too_old = False
+        if (
+            too_old
+            or (max_voices is not None and kept >= max_voices)
+            or (max_bytes is not None and kept_bytes + size > max_bytes)
+        ):
+            doomed.append(v)
+            continue
+        kept += 1
+        kept_bytes += size
+    return doomed
+
+
+def enforce_retention(db, batch_size: int = MAINTENANCE_BATCH_SIZE):
+    """Delete voices beyond each user's retention policy, in batches of ``batch_size`` rows."""
+    now = datetime.utcnow()
+    deleted = 0
+    freed_bytes = 0
+    batch = []
+    for user_id in db.list_voice_owner_ids():
+        user = db.get_user(user_id) or {}
+        policy = RETENTION_POLICIES["premium" if user.get("is_premium") else "free"]
+        for v in _voices_over_policy(db.list_voice_sizes(user_id), policy, now):
+            if v.get("file_path"):
+                try:
+                    if os.path.exists(v["file_path"]):
+                        os.remove(v["file_path"])
+                except Exception:
+                    pass
+            batch.append(v["id"])
+            freed_bytes += int(v.get("length") or 0)
+            if len(batch) >= batch_size:
+                db.delete_voices(batch)
+                deleted += len(batch)
+                batch = []
+    if batch:
+        db.delete_voices(batch)
+        deleted += len(batch)
+    return {"voices_deleted": deleted, "voice_bytes_freed": freed_bytes}
+
+
+def run_maintenance(db, store, state=None, owner: str = ""):
+    report = enforce_retention(db)
+    # Before compaction, so the audio of forgotten inline voices is reclaimed in the same run
+    db.prune_inline_voices(INLINE_CACHE_KEEP_DAYS)
+    compaction = _compact(db, store, state, owner, 3600) or {"segments": 0, "reclaimed_bytes": 0}
+    report["segments_compacted"] = compaction["segments"]
+    report["disk_bytes_reclaimed"] = compaction["reclaimed_bytes"]
+    db.prune_stats_active()
+    db.prune_text_counts(TEXT_COUNTS_KEEP_DAYS, TEXT_COUNTS_MAX_ROWS)
+    report.update(db.run_maintenance(MAINTENANCE_VACUUM_PAGES))
+    return report
+
+
+def format_maintenance_report(report) -> str:
+    return (
+        "🧹 Maintenance finished\n"
+        f"Voices deleted by retention: {report['voices_deleted']}\n"
+        f"Segments compacted: {report['segments_compacted']}\n"
+        f"Voice storage reclaimed: {report['disk_bytes_reclaimed'] // 1024} KiB\n"
+        f"Database reclaimed: {report['db_bytes_reclaimed'] // 1024} KiB"
+    )
+
+
+def _maintenance_worker(db, store, bot, interval_seconds: int, state=None, owner: str = ""):
+    last_run_day = None
+    while True:
+        time.sleep(interval_seconds)
+        now = datetime.utcnow()
+        if last_run_day == now.date() or not in_quiet_hours(now):
+            continue
+        # Lease lasts the whole day so other processes skip today's run
+        if not _holds_lease(state, MAINTENANCE_LEASE, owner, 24 * 3600):
+            continue
+        try:
+            report = run_maintenance(db, store, state, owner)
+            last_run_day = now.date()
+            logging.info(f"Maintenance report: {report}")
+            for aid in ADMIN_IDS[:1]:
+                try:
+                    bot.send_message(aid, format_maintenance_report(report))
+                except Exception:
+                    pass
+        except Exception as e:
+            logging.exception(f"Maintenance failed: {e}")
+
+
+def start_maintenance_thread(db, store, bot, interval_seconds: int = 3600, state=None):
+    owner = make_owner_id()
+    t = threading.Thread(target=_maintenance_worker, args=(db, store, bot, interval_seconds, state, owner), daemon=True)
+    t.start()
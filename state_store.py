@@ -0,0 +1,156 @@
+import abc
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Dict, Optional
+
+
+class StateStore(abc.ABC):
+    """
+    Shared key/value store for conversation state and singleton leases.
+
+    Values are JSON-serialisable dicts grouped by namespace. Implementations
+    must be safe to share between threads and between processes.
+    """
+
+    @abc.abstractmethod
+    def get(self, namespace: str, key: Any) -> Optional[Dict[str, Any]]:
+        ...
+
+    @abc.abstractmethod
+    def set(self, namespace: str, key: Any, value: Dict[str, Any], ttl_seconds: Optional[int] = None):
+        ...
+
+    @abc.abstractmethod
+    def delete(self, namespace: str, key: Any):
+        ...
+
+    @abc.abstractmethod
+    def pop(self, namespace: str, key: Any) -> Optional[Dict[str, Any]]:
+        ...
+
+    @abc.abstractmethod
+    def acquire_lease(self, name: str, owner: str, ttl_seconds: int) -> bool:
+        """Take or renew the lease ``name``; returns False while another owner holds it."""
+        ...
+
+    @abc.abstractmethod
+    def release_lease(self, name: str, owner: str):
+        ...
+
+
+class SQLiteStateStore(StateStore):
+    def __init__(self, path: str):
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        # WAL lets several bot processes read and write the same file concurrently.
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.lock = threading.Lock()
+        self._init_schema()
+
+    def _init_schema(self):
+        with self.lock:
+            cur = self.conn.cursor()
+            cur.execute(
+                """
+                CREATE TABLE IF NOT EXISTS kv_state (
+                    namespace TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    value TEXT,
+                    expires_at REAL,
+                    PRIMARY KEY (namespace, key)
+                )
+                """
+            )
+            cur.execute(
+                """
+                CREATE TABLE IF NOT EXISTS leases (
+                    name TEXT PRIMARY KEY,
+                    owner TEXT,
+                    expires_at REAL
+                )
+                """
+            )
+            self.conn.commit()
+
+    def get(self, namespace: str, key: Any) -> Optional[Dict[str, Any]]:
+        with self.lock:
+            cur = self.conn.cursor()
+            cur.execute(
+                "SELECT value FROM kv_state WHERE namespace = ? AND key = ? AND (expires_at IS NULL OR expires_at > ?)",
+                (namespace, str(key), time.time()),
+            )
+            row = cur.fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, namespace: str, key: Any, value: Dict[str, Any], ttl_seconds: Optional[int] = None):
+        now = time.time()
+        expires_at = now + ttl_seconds if ttl_seconds else None
+        with self.lock:
+            cur = self.conn.cursor()
+            cur.execute("DELETE FROM kv_state WHERE expires_at IS NOT NULL AND expires_at <= ?", (now,))
+            cur.execute(
+                "INSERT OR REPLACE INTO kv_state (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)",
+                (namespace, str(key), json.dumps(value), expires_at),
+            )
+            self.conn.commit()
+
+    def delete(self, namespace: str, key: Any):
+        with self.lock:
+            cur = self.conn.cursor()
+            cur.execute("DELETE FROM kv_state WHERE namespace = ? AND key = ?", (namespace, str(key)))
+            self.conn.commit()
+
+    def pop(self, namespace: str, key: Any) -> Optional[Dict[str, Any]]:
+        with self.lock:
+            cur = self.conn.cursor()
+            cur.execute("BEGIN IMMEDIATE")
+            try:
+                cur.execute(
+                    "SELECT value FROM kv_state WHERE namespace = ? AND key = ? AND (expires_at IS NULL OR expires_at > ?)",
+                    (namespace, str(key), time.time()),
+                )
+                row = cur.fetchone()
+                cur.execute("DELETE FROM kv_state WHERE namespace = ? AND key = ?", (namespace, str(key)))
+                self.conn.commit()
+            except Exception:
+                self.conn.rollback()
+                raise
+        return json.loads(row[0]) if row else None
+
+    def acquire_lease(self, name: str, owner: str, ttl_seconds: int) -> bool:
+        now = time.time()
+        with self.lock:
+            cur = self.conn.cursor()
+            cur.execute(
+                """
+                INSERT INTO leases (name, owner, expires_at) VALUES (?, ?, ?)
+                ON CONFLICT(name) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at
+                WHERE leases.owner = excluded.owner OR leases.expires_at <= ?
+                """,
+                (name, owner, now + ttl_seconds, now),
+            )
+            self.conn.commit()
+            cur.execute("SELECT owner FROM leases WHERE name = ?", (name,))
+            row = cur.fetchone()
+        return bool(row) and row[0] == owner
+
+    def release_lease(self, name: str, owner: str):
+        with self.lock:
+            cur = self.conn.cursor()
+            cur.execute("DELETE FROM leases WHERE name = ? AND owner = ?", (name, owner))
+            self.conn.commit()
+
+
+def make_owner_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+def create_state_store(backend: str, path: str) -> StateStore:
+    backend = (backend or "sqlite").lower()
+    if backend == "sqlite":
+        return SQLiteStateStore(path)
+    raise ValueError(f"Unknown state backend: {backend}")
@@ -0,0 +1,159 @@
+import asyncio
+import contextvars
+import functools
+import logging
+import random
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from typing import List, Optional, Tuple
+from config import TRACE_SAMPLE_RATE, TRACE_SLOW_MS, TRACE_BUFFER_SIZE
+
+_current: contextvars.ContextVar = contextvars.ContextVar("trace", default=None)
+
+
+class Trace:
+    """
+    Timings of one request. Every trace gets an id for the logs; only
+    sampled traces collect stage spans and can enter the slow buffer.
+    """
+
+    def __init__(self, name: str, sampled: bool, **attrs):
+        self.trace_id = uuid.uuid4().hex[:12]
+        self.name = name
+        self.sampled = sampled
+        self.attrs = attrs
+        self.started_at = time.time()
+        self._t0 = time.perf_counter()
+        self.spans: List[Tuple[str, float]] = []
+        self.total_ms = 0.0
+
+    def record(self, stage: str, ms: float):
+        if self.sampled:
+            self.spans.append((stage, ms))
+
+    def finish(self):
+        self.total_ms = (time.perf_counter() - self._t0) * 1000
+        if self.sampled and self.total_ms >= TRACE_SLOW_MS:
+            SLOW_TRACES.add(self)
+            logging.warning(f"Slow {self.name} trace {self.trace_id}: {self.total_ms:.0f}ms {format_spans(self)}")
+
+
+class SlowTraceBuffer:
+    def __init__(self, size: int):
+        self._items = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def add(self, trace: Trace):
+        with self._lock:
+            self._items.append(trace)
+
+    def worst(self, n: int = 10) -> List[Trace]:
+        with self._lock:
+            items = list(self._items)
+        return sorted(items, key=lambda t: t.total_ms, reverse=True)[:n]
+
+
+SLOW_TRACES = SlowTraceBuffer(TRACE_BUFFER_SIZE)
+
+
+def current_trace() -> Optional[Trace]:
+    return _current.get()
+
+
+@contextmanager
+def trace(name: str, **attrs):
+    t = Trace(name, random.random() < TRACE_SAMPLE_RATE, **attrs)
+    token = _current.set(t)
+    try:
+        yield t
+    finally:
+        _current.reset(token)
+        t.finish()
+
+
+@contextmanager
+def span(stage: str):
+    """Time a stage of the current trace; a no-op outside a sampled trace."""
+    t = _current.get()
+    if t is None or not t.sampled:
+        yield
+        return
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        t.record(stage, (time.perf_counter() - t0) * 1000)
+
+
+class TransferTimer:
+    """Records ``<prefix>_ttfb`` (first chunk) and ``<prefix>_total`` for a streamed download."""
+
+    def __init__(self, prefix: str):
+        self.prefix = prefix
+        self.trace = _current.get()
+        self._t0 = time.perf_counter()
+        self._first = None
+
+    def chunk(self):
+        if self._first is None:
+            self._first = time.perf_counter()
+
+    def done(self):
+        if self.trace is None:
+            return
+        end = time.perf_counter()
+        self.trace.record(f"{self.prefix}_ttfb", ((self._first or end) - self._t0) * 1000)
+        self.trace.record(f"{self.prefix}_total", (end - self._t0) * 1000)
+
+
+def traced(name: str):
+    """Run a message handler (sync or async) inside a trace tagged with the user id and text length."""
+    def decorator(fn):
+        def attrs_of(message):
+            return {
+                "user_id": getattr(getattr(message, "from_user", None), "id", None),
+                "chars": len(getattr(message, "text", None) or ""),
+            }
+
+        if asyncio.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(message, *args, **kwargs):
+                with trace(name, **attrs_of(message)):
+                    return await fn(message, *args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(message, *args, **kwargs):
+            with trace(name, **attrs_of(message)):
+                return fn(message, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class TraceIdFilter(logging.Filter):
+    """Adds ``trace_id`` to log records so log lines can be matched to a trace."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        t = _current.get()
+        record.trace_id = t.trace_id if t else "-"
+        return True
+
+
+def format_spans(t: Trace) -> str:
+    return " ".join(f"{stage}={ms:.0f}ms" for stage, ms in t.spans)
+
+
+def format_slow_traces(traces: List[Trace]) -> str:
+    if not traces:
+        return f"No traces slower than {TRACE_SLOW_MS}ms recorded."
+    lines = [f"🐢 Slowest recent requests (>{TRACE_SLOW_MS}ms)"]
+    for t in traces:
+        when = time.strftime("%m-%d %H:%M:%S", time.gmtime(t.started_at))
+        lines.append(
+            f"• {when} {t.name} <code>{t.trace_id}</code> {t.total_ms:.0f}ms "
+            f"user={t.attrs.get('user_id')} chars={t.attrs.get('chars')}\n  {format_spans(t)}"
+        )
+    return "\n".join(lines)
@@ -1,17 +1,20 @@
-import os
+import asyncio
 import re
-from datetime import datetime
 import telebot
 from telebot import types
 from config import (
     ADMIN_CONTACT,
     WEBSITE_URL,
     COST_PER_VOICE,
-    VOICES_DIR,
     REQUIRE_VALIDITY_FOR_TTS,
     MAX_TTS_CHARS,
+    PLANS,
 )
-from fish_audio import FishAudioClient
+from fish_audio import FishAudioClient, AsyncFishAudioClient
+from dispatch import LANE_INTERACTIVE
+from router import Router, CB_MODEL, CB_SPEED, cb_data
+from tracing import traced, span
+from voice_store import read_stored, store_voice_copy
 
 
 def build_user_keyboard() -> types.ReplyKeyboardMarkup:
@@ -27,7 +30,7 @@ def build_models_keyboard(models):
     row = []
     for m in models:
         label = m.get("name") or m.get("id")
-        row.append(types.InlineKeyboardButton(text=label, callback_data=f"model:{m.get('id')}"))
+        row.append(types.InlineKeyboardButton(text=label, callback_data=cb_data(CB_MODEL, m.get("id"))))
         if len(row) == 2:
             kb.row(*row)
             row = []
@@ -52,19 +55,27 @@ def humanize_text(s: str) -> str:
     return s.strip()
 
 
+def phrase_key(text: str) -> str:
+    """Lookup key for the phrase library: case- and whitespace-insensitive."""
+    return re.sub(r"\s+", " ", (text or "").strip()).lower()
+
+
 def build_speed_keyboard():
     kb = types.InlineKeyboardMarkup()
     kb.row(
-        types.InlineKeyboardButton("⚡ Fast", callback_data="speed:fast"),
-        types.InlineKeyboardButton("🙂 Natural", callback_data="speed:natural"),
+        types.InlineKeyboardButton("⚡ Fast", callback_data=cb_data(CB_SPEED, "fast")),
+        types.InlineKeyboardButton("🙂 Natural", callback_data=cb_data(CB_SPEED, "natural")),
     )
     kb.row(
-        types.InlineKeyboardButton("😐 Normal", callback_data="speed:normal"),
-        types.InlineKeyboardButton("🐢 Slow", callback_data="speed:slow"),
+        types.InlineKeyboardButton("😐 Normal", callback_data=cb_data(CB_SPEED, "normal")),
+        types.InlineKeyboardButton("🐢 Slow", callback_data=cb_data(CB_SPEED, "slow")),
     )
     return kb
 
 
+SPEED_MODES = ("fast", "normal", "natural", "slow")
+
+
 def speed_to_value(mode: str) -> float:
     mode = (mode or "natural").lower()
     return {
@@ -80,136 +91,296 @@ def speed_to_label(mode: str) -> str:
     return {"fast": "Fast", "normal": "Normal", "natural": "Natural", "slow": "Slow"}.get(mode, "Natural")
 
 
-def register_user_handlers(bot: telebot.TeleBot, db):
+def plans_text() -> str:
+    lines = ["Available plans:"]
+    for p in PLANS:
+        lines.append(f"• {p['name']}: {p['credits']} credits, {p['price']}, validity {p['validity_days']} days")
+    return "\n".join(lines)
+
+
+def usage_text(user, voices_count: int, models) -> str:
+    selected_id = user.get("selected_model")
+    selected_name = get_model_name(models, selected_id) if selected_id else "Not selected"
+    mode = (user.get("tts_speed") or "natural").strip().lower()
+    return (
+        f"Status: {'Premium' if user.get('is_premium') else 'Normal'}\n"
+        f"Credits: {user.get('credits') or 0}\n"
+        f"Validity: {user.get('validity_expire_at') or 'No validity'}\n"
+        f"Selected model: {selected_name}\n"
+        f"Speed: {speed_to_label(mode)}\n"
+        f"Voices saved: {voices_count}"
+    )
+
+
+def tts_precheck(txt: str, user, valid: bool):
+    """Return an error message if this text may not be synthesized for ``user``."""
+    if len(txt) > MAX_TTS_CHARS:
+        return f"Text too long. Limit: {MAX_TTS_CHARS} characters."
+    if (user.get("credits") or 0) <= 0:
+        return "❌ You have no credits."
+    if not valid:
+        return "❌ Your validity expired."
+    if not user.get("selected_model"):
+        return "Please select a model first."
+    return None
+
+
+def voice_generated_text(models, model: str, mode: str, remaining: int) -> str:
+    return (
+        f"🎙️ Voice generated! (Model: <b>{get_model_name(models, model)}</b>, Speed: <b>{speed_to_label(mode)}</b>)\n"
+        f"{COST_PER_VOICE} credit deducted. Remaining: {remaining}"
+    )
+
+
+def register_user_handlers(bot: telebot.TeleBot, db, store, router: Router):
     client = FishAudioClient()
 
+    if hasattr(bot, "add_lane_rule"):
+        bot.add_lane_rule(lambda u: u.message is not None and router.is_menu(u.message.text), LANE_INTERACTIVE)
+
     @bot.message_handler(commands=["start"])
     def cmd_start(message: types.Message):
         db.ensure_user(message.from_user.id, message.from_user.username)
         bot.send_message(message.chat.id, "Welcome! Use the buttons below.", reply_markup=build_user_keyboard())
 
-    @bot.message_handler(func=lambda m: m.text == "Contact Admin")
+    @router.on_text("Contact Admin")
     def contact_admin(message: types.Message):
         bot.send_message(message.chat.id, f"Contact admin: {ADMIN_CONTACT}")
 
-    @bot.message_handler(func=lambda m: m.text == "Our Website")
+    @router.on_text("Our Website")
     def website(message: types.Message):
         bot.send_message(message.chat.id, f"Website: {WEBSITE_URL}")
 
-    @bot.message_handler(func=lambda m: m.text == "Plans")
+    @router.on_text("Plans")
     def plans(message: types.Message):
-        from config import PLANS
-        lines = ["Available plans:"]
-        for p in PLANS:
-            lines.append(f"• {p['name']}: {p['credits']} credits, {p['price']}, validity {p['validity_days']} days")
-        bot.send_message(message.chat.id, "\n".join(lines))
+        bot.send_message(message.chat.id, plans_text())
 
-    @bot.message_handler(func=lambda m: m.text == "Voice Speed")
+    @router.on_text("Voice Speed")
     def voice_speed_menu(message: types.Message):
         bot.send_message(message.chat.id, "Choose voice speed:", reply_markup=build_speed_keyboard())
 
-    @bot.callback_query_handler(func=lambda c: c.data and c.data.startswith("speed:"))
-    def speed_chosen(callback: types.CallbackQuery):
-        mode = callback.data.split(":", 1)[1].strip().lower()
+    @router.on_callback(CB_SPEED)
+    def speed_chosen(callback: types.CallbackQuery, args):
+        mode = args[0].strip().lower()
         db.update_user_fields(callback.from_user.id, {"tts_speed": mode})
         bot.send_message(callback.message.chat.id, f"✅ Speed set to: <b>{speed_to_label(mode)}</b>")
         bot.answer_callback_query(callback.id)
 
-    @bot.message_handler(func=lambda m: m.text == "Usage")
+    @router.on_text("Usage")
     def usage(message: types.Message):
         user = db.get_user(message.from_user.id)
-        voices = db.list_user_voices(message.from_user.id)
-        models = client.list_models()
-
-        selected_id = user.get("selected_model")
-        selected_name = get_model_name(models, selected_id) if selected_id else "Not selected"
-        mode = (user.get("tts_speed") or "natural").strip().lower()
+        voices_count = db.count_user_voices(message.from_user.id)
+        bot.send_message(message.chat.id, usage_text(user, voices_count, client.list_models()))
 
-        bot.send_message(
-            message.chat.id,
-            f"Status: {'Premium' if user.get('is_premium') else 'Normal'}\n"
-            f"Credits: {user.get('credits') or 0}\n"
-            f"Validity: {user.get('validity_expire_at') or 'No validity'}\n"
-            f"Selected model: {selected_name}\n"
-            f"Speed: {speed_to_label(mode)}\n"
-            f"Voices saved: {len(voices)}",
-        )
-
-    @bot.message_handler(func=lambda m: m.text == "Select Model")
+    @router.on_text("Select Model")
     def select_model(message: types.Message):
         models = client.list_models()
         bot.send_message(message.chat.id, "Choose a model:", reply_markup=build_models_keyboard(models))
 
-    @bot.callback_query_handler(func=lambda c: c.data and c.data.startswith("model:"))
-    def model_chosen(callback: types.CallbackQuery):
-        voice_id = callback.data.split(":", 1)[1]
+    @router.on_callback(CB_MODEL)
+    def model_chosen(callback: types.CallbackQuery, args):
+        voice_id = args[0]
         db.update_user_fields(callback.from_user.id, {"selected_model": voice_id})
         model_name = get_model_name(client.list_models(), voice_id)
         bot.send_message(callback.message.chat.id, f"✅ Model selected: <b>{model_name}</b>\nNow send text to generate voice.")
         bot.answer_callback_query(callback.id)
 
-    @bot.message_handler(content_types=["text"])
+    @router.on_other_text
+    @traced("tts")
     def tts_entry(message: types.Message):
         txt = (message.text or "").strip()
 
-        if txt in ("Select Model", "Plans", "Usage", "Contact Admin", "Our Website", "Voice Speed"):
-            return
-
-        if len(txt) > MAX_TTS_CHARS:
-            bot.send_message(message.chat.id, f"Text too long. Limit: {MAX_TTS_CHARS} characters.")
-            return
-
-        user = db.get_user(message.from_user.id)
+        with span("db_read"):
+            user = db.get_user(message.from_user.id)
+            valid = db.is_valid(message.from_user.id) if REQUIRE_VALIDITY_FOR_TTS else True
         credits = user.get("credits") or 0
 
-        if credits <= 0:
-            bot.send_message(message.chat.id, "❌ You have no credits.")
-            return
-
-        if REQUIRE_VALIDITY_FOR_TTS and not db.is_valid(message.from_user.id):
-            bot.send_message(message.chat.id, "❌ Your validity expired.")
+        error = tts_precheck(txt, user, valid)
+        if error:
+            bot.send_message(message.chat.id, error)
             return
 
         model = user.get("selected_model")
-        if not model:
-            bot.send_message(message.chat.id, "Please select a model first.")
-            return
-
         mode = (user.get("tts_speed") or "natural").strip().lower()
         spd = speed_to_value(mode)
+        caption = voice_generated_text(client.list_models(), model, mode, credits - COST_PER_VOICE)
+
+        key = phrase_key(txt)
+        with span("phrase_cache"):
+            db.count_text(key, txt)
+            cached = db.get_phrase_audio(key, model, mode)
+
+        if cached:
+            # Pre-synthesized phrase: reuse the uploaded file_id, or upload once from the store
+            with span("send_voice"):
+                voice = cached["file_id"] or read_stored(store, lambda: db.get_phrase_audio_by_id(cached["id"]) or cached)
+                sent = bot.send_voice(message.chat.id, voice, caption=caption)
+            if not cached["file_id"] and sent.voice:
+                db.set_phrase_file_id(cached["id"], sent.voice.file_id)
+            db.record_stat("phrase_hits")
+        else:
+            with span("humanize"):
+                txt_natural = humanize_text(txt)
+
+            try:
+                audio_bytes = client.synthesize_text(
+                    txt_natural,
+                    model,
+                    language="en",
+                    format_="opus",
+                    speed=spd,
+                    latency="slow",
+                )
+            except Exception as e:
+                db.record_upstream_error(model)
+                bot.send_message(message.chat.id, f"TTS error: {e}")
+                return
+
+            with span("store_write"):
+                segment, offset, length = store.append(audio_bytes)
+
+            # The confirmation rides along as the voice caption: one API call per voice
+            with span("send_voice"):
+                bot.send_voice(message.chat.id, audio_bytes, caption=caption)
+
+        with span("db_write"):
+            if cached:
+                store_voice_copy(
+                    store, db, message.from_user.id, lambda: db.get_phrase_audio_by_id(cached["id"]) or cached, len(txt)
+                )
+            else:
+                db.store_voice(
+                    message.from_user.id, segment=segment, offset=offset, length=length, model=model, chars=len(txt)
+                )
+            db.remove_credits(message.from_user.id, COST_PER_VOICE, consumed=True)
+
+
+def register_user_handlers_async(bot, db, store, router: Router):
+    """
+    Same user flows as register_user_handlers, for an AsyncTeleBot.
+
+    Database calls and voice-store appends run in the default executor and
+    Fish Audio goes through the pooled async client.
+    """
+    client = AsyncFishAudioClient()
+
+    async def run_db(fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(None, fn, *args)
 
-        txt_natural = humanize_text(txt)
-
-        try:
-            audio_bytes = client.synthesize_text(
-                txt_natural,
-                model,
-                language="en",
-                format_="opus",
-                speed=spd,
-                latency="slow",
-            )
-        except Exception as e:
-            bot.send_message(message.chat.id, f"TTS error: {e}")
-            return
-
-        user_dir = os.path.join(VOICES_DIR, str(message.from_user.id))
-        os.makedirs(user_dir, exist_ok=True)
-        ts = datetime.utcnow().strftime("%Y%m%d_%H%M%S")
-        ogg_path = os.path.join(user_dir, f"tts_{ts}.ogg")
-
-        with open(ogg_path, "wb") as f:
-            f.write(audio_bytes)
+    @bot.message_handler(commands=["start"])
+    async def cmd_start(message: types.Message):
+        await run_db(db.ensure_user, message.from_user.id, message.from_user.username)
+        await bot.send_message(message.chat.id, "Welcome! Use the buttons below.", reply_markup=build_user_keyboard())
+
+    @router.on_text("Contact Admin")
+    async def contact_admin(message: types.Message):
+        await bot.send_message(message.chat.id, f"Contact admin: {ADMIN_CONTACT}")
+
+    @router.on_text("Our Website")
+    async def website(message: types.Message):
+        await bot.send_message(message.chat.id, f"Website: {WEBSITE_URL}")
+
+    @router.on_text("Plans")
+    async def plans(message: types.Message):
+        await bot.send_message(message.chat.id, plans_text())
+
+    @router.on_text("Voice Speed")
+    async def voice_speed_menu(message: types.Message):
+        await bot.send_message(message.chat.id, "Choose voice speed:", reply_markup=build_speed_keyboard())
+
+    @router.on_callback(CB_SPEED)
+    async def speed_chosen(callback: types.CallbackQuery, args):
+        mode = args[0].strip().lower()
+        await run_db(db.update_user_fields, callback.from_user.id, {"tts_speed": mode})
+        await bot.send_message(callback.message.chat.id, f"✅ Speed set to: <b>{speed_to_label(mode)}</b>")
+        await bot.answer_callback_query(callback.id)
+
+    @router.on_text("Usage")
+    async def usage(message: types.Message):
+        user = await run_db(db.get_user, message.from_user.id)
+        voices_count = await run_db(db.count_user_voices, message.from_user.id)
+        await bot.send_message(message.chat.id, usage_text(user, voices_count, await client.list_models()))
+
+    @router.on_text("Select Model")
+    async def select_model(message: types.Message):
+        models = await client.list_models()
+        await bot.send_message(message.chat.id, "Choose a model:", reply_markup=build_models_keyboard(models))
+
+    @router.on_callback(CB_MODEL)
+    async def model_chosen(callback: types.CallbackQuery, args):
+        voice_id = args[0]
+        await run_db(db.update_user_fields, callback.from_user.id, {"selected_model": voice_id})
+        model_name = get_model_name(await client.list_models(), voice_id)
+        await bot.send_message(callback.message.chat.id, f"✅ Model selected: <b>{model_name}</b>\nNow send text to generate voice.")
+        await bot.answer_callback_query(callback.id)
+
+    @router.on_other_text
+    @traced("tts")
+    async def tts_entry(message: types.Message):
+        txt = (message.text or "").strip()
 
-        with open(ogg_path, "rb") as vf:
-            bot.send_voice(message.chat.id, vf)
+        with span("db_read"):
+            user = await run_db(db.get_user, message.from_user.id)
+            valid = await run_db(db.is_valid, message.from_user.id) if REQUIRE_VALIDITY_FOR_TTS else True
+        credits = user.get("credits") or 0
 
-        db.store_voice(message.from_user.id, ogg_path)
-        db.remove_credits(message.from_user.id, COST_PER_VOICE)
+        error = tts_precheck(txt, user, valid)
+        if error:
+            await bot.send_message(message.chat.id, error)
+            return
 
-        model_name = get_model_name(client.list_models(), model)
-        bot.send_message(
-            message.chat.id,
-            f"🎙️ Voice generated! (Model: <b>{model_name}</b>, Speed: <b>{speed_to_label(mode)}</b>)\n"
-            f"1 credit deducted. Remaining: {credits - 1}"
-        )
+        model = user.get("selected_model")
+        mode = (user.get("tts_speed") or "natural").strip().lower()
+        caption = voice_generated_text(await client.list_models(), model, mode, credits - COST_PER_VOICE)
+
+        key = phrase_key(txt)
+        with span("phrase_cache"):
+            await run_db(db.count_text, key, txt)
+            cached = await run_db(db.get_phrase_audio, key, model, mode)
+
+        if cached:
+            with span("send_voice"):
+                if cached["file_id"]:
+                    voice = cached["file_id"]
+                else:
+                    voice = await run_db(read_stored, store, lambda: db.get_phrase_audio_by_id(cached["id"]) or cached)
+                sent = await bot.send_voice(message.chat.id, voice, caption=caption)
+            if not cached["file_id"] and sent.voice:
+                await run_db(db.set_phrase_file_id, cached["id"], sent.voice.file_id)
+            await run_db(db.record_stat, "phrase_hits")
+        else:
+            with span("humanize"):
+                txt_natural = humanize_text(txt)
+
+            try:
+                audio_bytes = await client.synthesize_text(
+                    txt_natural,
+                    model,
+                    language="en",
+                    format_="opus",
+                    speed=speed_to_value(mode),
+                    latency="slow",
+                )
+            except Exception as e:
+                await run_db(db.record_upstream_error, model)
+                await bot.send_message(message.chat.id, f"TTS error: {e}")
+                return
+
+            with span("store_write"):
+                segment, offset, length = await run_db(store.append, audio_bytes)
+
+            with span("send_voice"):
+                await bot.send_voice(message.chat.id, audio_bytes, caption=caption)
+
+        with span("db_write"):
+            if cached:
+                await run_db(lambda: store_voice_copy(
+                    store, db, message.from_user.id, lambda: db.get_phrase_audio_by_id(cached["id"]) or cached, len(txt)
+                ))
+            else:
+                await run_db(lambda: db.store_voice(
+                    message.from_user.id, segment=segment, offset=offset, length=length, model=model, chars=len(txt)
+                ))
+            await run_db(lambda: db.remove_credits(message.from_user.id, COST_PER_VOICE, consumed=True))
+
+    return client
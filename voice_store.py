@@ -0,0 +1,192 @@
+import fcntl
+import mmap
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Optional, Tuple
+
+SEGMENT_RE = re.compile(r"^seg_(\d{6})\.pack$")
+
+
+class VoiceStore:
+    """
+    Append-only pack files for generated voices.
+
+    Audio is appended to the newest segment under ``<root>/segments`` and
+    addressed by (segment, offset, length), which the ``voices`` table keeps.
+    Segments roll over at ``max_segment_bytes``; sealed segments are never
+    written again except by compaction, which copies their live records into
+    the active segment and unlinks them.
+    """
+
+    def __init__(self, root: str, max_segment_bytes: int):
+        self.dir = os.path.join(root, "segments")
+        os.makedirs(self.dir, exist_ok=True)
+        self.max_segment_bytes = max_segment_bytes
+        self._lock = threading.Lock()
+        self._maps: Dict[str, Tuple[mmap.mmap, int]] = {}
+        self._maps_lock = threading.Lock()
+
+    def _path(self, segment: str) -> str:
+        return os.path.join(self.dir, segment)
+
+    def segments(self):
+        return sorted(n for n in os.listdir(self.dir) if SEGMENT_RE.match(n))
+
+    def active_segment(self) -> str:
+        names = self.segments()
+        if not names:
+            return "seg_000001.pack"
+        last = names[-1]
+        if os.path.getsize(self._path(last)) >= self.max_segment_bytes:
+            n = int(SEGMENT_RE.match(last).group(1)) + 1
+            return f"seg_{n:06d}.pack"
+        return last
+
+    def append(self, data: bytes) -> Tuple[str, int, int]:
+        """Append ``data`` and return its (segment, offset, length)."""
+        # Thread lock for this process, flock for other processes sharing the volume
+        with self._lock, open(os.path.join(self.dir, ".lock"), "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                segment = self.active_segment()
+                with open(self._path(segment), "ab") as f:
+                    offset = f.seek(0, os.SEEK_END)
+                    f.write(data)
+                    f.flush()
+                    os.fsync(f.fileno())
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+        return segment, offset, len(data)
+
+    @contextmanager
+    def _relocation_lock(self, mode: int):
+        with open(os.path.join(self.dir, ".relocate.lock"), "a") as lock_file:
+            fcntl.flock(lock_file, mode)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def pinned(self):
+        """
+        Shared hold on stored locations, across processes: compaction takes
+        the same lock exclusively while it moves and unlinks a segment, so a
+        location read inside the block stays valid until it ends.
+        """
+        return self._relocation_lock(fcntl.LOCK_SH)
+
+    def relocating(self):
+        return self._relocation_lock(fcntl.LOCK_EX)
+
+    def _map(self, segment: str, end: int) -> mmap.mmap:
+        with self._maps_lock:
+            cached = self._maps.get(segment)
+            if cached and cached[1] >= end:
+                return cached[0]
+            with open(self._path(segment), "rb") as f:
+                size = os.fstat(f.fileno()).st_size
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            # Older maps of a growing segment are left to the GC: views handed out may still use them
+            self._maps[segment] = (mm, size)
+            return mm
+
+    def read(self, segment: str, offset: int, length: int) -> memoryview:
+        """Zero-copy view of a stored voice."""
+        mm = self._map(segment, offset + length)
+        return memoryview(mm)[offset:offset + length]
+
+    def forget(self, segment: str):
+        with self._maps_lock:
+            self._maps.pop(segment, None)
+
+    def remove_segment(self, segment: str):
+        self.forget(segment)
+        try:
+            os.remove(self._path(segment))
+        except FileNotFoundError:
+            pass
+
+    def segment_mtime(self, segment: str) -> float:
+        try:
+            return os.path.getmtime(self._path(segment))
+        except FileNotFoundError:
+            return 0.0
+
+    def segment_size(self, segment: str) -> int:
+        try:
+            return os.path.getsize(self._path(segment))
+        except FileNotFoundError:
+            return 0
+
+
+def compact_voice_store(store: VoiceStore, db, min_dead_ratio: float, grace_seconds: int = 0) -> Dict[str, int]:
+    """
+    Rewrite sealed segments whose dead share is at least ``min_dead_ratio``.
+
+    Live records are appended to the active segment and their rows repointed
+    before the old segment is unlinked. Segments written to within
+    ``grace_seconds`` are skipped: their last appends may not have a row
+    yet and would look dead. Returns counters for logging.
+    """
+    live = db.voice_segment_live_bytes()
+    active = store.active_segment()
+    settled_before = time.time() - grace_seconds
+    result = {"segments": 0, "moved": 0, "reclaimed_bytes": 0}
+    for segment in store.segments():
+        if segment == active or store.segment_mtime(segment) > settled_before:
+            continue
+        size = store.segment_size(segment)
+        if size <= 0:
+            continue
+        dead_ratio = 1 - (live.get(segment, 0) / size)
+        if dead_ratio < min_dead_ratio:
+            continue
+
+        moved_bytes = 0
+        moved = {}  # (offset, length) -> new location, so shared records are copied once
+        # Rows copied from another table's location (phrase and inline hits)
+        # are made under ``pinned``, so none can appear between listing and unlinking
+        with store.relocating():
+            for v in db.list_segment_voices(segment):
+                key = (v["offset"], v["length"])
+                if key not in moved:
+                    data = bytes(store.read(segment, v["offset"], v["length"]))
+                    moved[key] = store.append(data)[:2]
+                    moved_bytes += v["length"]
+                new_segment, new_offset = moved[key]
+                db.update_voice_location(v["id"], new_segment, new_offset, table=v.get("tbl", "voices"))
+                result["moved"] += 1
+            store.remove_segment(segment)
+        result["segments"] += 1
+        result["reclaimed_bytes"] += size - moved_bytes
+    return result
+
+
+def read_stored(store: VoiceStore, fetch: Callable[[], Optional[dict]]) -> Optional[bytes]:
+    """
+    Audio of the row ``fetch`` returns, re-read under ``pinned`` because
+    compaction may have moved it since the caller looked it up.
+    """
+    with store.pinned():
+        row = fetch()
+        if not row:
+            return None
+        return bytes(store.read(row["segment"], row["offset"], row["length"]))
+
+
+def store_voice_copy(store: VoiceStore, db, user_id: int, fetch: Callable[[], Optional[dict]], chars: int) -> Optional[int]:
+    """
+    Record a voice for ``user_id`` that shares the audio of the row ``fetch``
+    returns (a phrase or inline hit). Returns the new voice id, or None if
+    the source row is gone.
+    """
+    with store.pinned():
+        row = fetch()
+        if not row:
+            return None
+        return db.store_voice(
+            user_id, segment=row["segment"], offset=row["offset"], length=row["length"], model=row["model"], chars=chars
+        )